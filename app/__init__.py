@@ -1,7 +1,5 @@
 # app/__init__.py
 
-from .main import app
-
 __all__ = ['app']
 
 """
@@ -9,9 +7,17 @@ Image Tagging Application Package
 """
 
 # Import necessary modules for the package
-from .main import app  # Import the FastAPI app
 from .localDB import *  # Import all database functions
 from .image_cache import *  # Import all image caching functions
 from .text_extract import *  # Import all text extraction functions
 
-# You can also define package-level variables or functions here if needed
\ No newline at end of file
+
+def __getattr__(name):
+    # The FastAPI app loads the ResNet weights on import, so only pull it in
+    # when it is asked for. Benchmarks and tools can import submodules cheaply.
+    if name == 'app':
+        from .main import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# You can also define package-level variables or functions here if needed
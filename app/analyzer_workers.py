@@ -0,0 +1,324 @@
+"""Analyzers in supervised worker processes, fed through shared memory.
+
+The classifier, the face detector and the palette extraction hold the GIL for
+much of their run; in the process that also runs the Qt GUI and the API they
+make both stutter. isolate() moves such analyzers into worker processes.
+
+The pixels an analyzer needs (its input_side variant of the decoded image)
+are written once into a multiprocessing.shared_memory block, shared by every
+isolated analyzer that wants that size. Only the block's name and shape go
+through the task queue. The worker maps the block as a numpy array without
+copying and runs the ordinary analyzer on it. Tags and small outputs such as
+the embedding come back through a result queue.
+
+A pool's collector thread also supervises its workers. When a worker dies,
+its in-flight images fail that analyzer (the pipeline records the error as
+usual) and a fresh process takes its place. A worker that keeps dying is
+restarted after a growing delay; the collector never waits that out, so
+results from the other workers keep flowing meanwhile.
+"""
+import time
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+from PIL import Image
+
+from .localDB import LocalDB
+from .pipeline import Analyzer, DecodedImage
+from .metrics import WORKER_RESTARTS, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Analyzers worth a process of their own: GIL-heavy, and synchronous in the pipeline
+ISOLATABLE = ('classifier', 'faces', 'colors')
+RESTART_DELAY = 1.0  # Seconds before replacing a worker that died, doubled per crash in a row
+MAX_RESTART_DELAY = 60.0
+
+_frames_lock = threading.Lock()
+
+
+class SharedFrame:
+    """HxWx3 uint8 pixels in a shared memory block, released after its last user."""
+
+    def __init__(self, pixels):
+        self.shape = pixels.shape
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, pixels.nbytes))
+        np.ndarray(self.shape, np.uint8, buffer=self.memory.buf)[...] = pixels
+        self.users = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def release(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def acquire_frame(decoded, min_side):
+    """decoded's min_side variant in shared memory, written on first use."""
+    with _frames_lock:
+        frame = decoded.shared_frames.get(min_side)
+        if frame is None:
+            frame = decoded.shared_frames[min_side] = SharedFrame(decoded.pixels(min_side))
+        frame.users += 1
+        return frame
+
+
+def release_frame(decoded, min_side):
+    with _frames_lock:
+        frame = decoded.shared_frames[min_side]
+        frame.users -= 1
+        if frame.users:
+            return
+        del decoded.shared_frames[min_side]
+    frame.release()
+
+
+def _attach(name):
+    """Map an existing block without making this process responsible for unlinking it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block, and the tracker would unlink it on exit
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+class SharedDecodedImage(DecodedImage):
+    """DecodedImage over a frame mapped from shared memory.
+
+    pixels() hands out the mapped array itself; a PIL image is only built
+    (by copying) for analyzers that ask for one.
+    """
+
+    def __init__(self, path, frame):
+        self.frame = frame
+        self._image = None
+        super().__init__(path, None)
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.fromarray(self.frame)
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+
+    @property
+    def size(self):
+        return self.frame.shape[1], self.frame.shape[0]
+
+    def pixels(self, min_side=None):
+        if min_side is None or min(self.frame.shape[:2]) <= min_side:
+            return self.frame
+        return super().pixels(min_side)
+
+
+def _worker_main(name, database, threads, tasks, results):
+    # Imported here: they load torch and OpenCV, which only the worker needs
+    from .pipeline import default_pipeline
+    from .concurrency import ThreadBudget, STAGE_POOLS
+    pool = STAGE_POOLS.get(name, 'opencv')
+    if threads is None:
+        threads = ThreadBudget.from_env().threads(pool)
+    # threads is already this analyzer's share; all of it goes to the one pool it computes in
+    ThreadBudget(threads, {pool: 1}).apply()
+    analyzer = default_pipeline(LocalDB(database=database)).analyzers[name]
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, path, memory_name, shape = task
+        memory = _attach(memory_name)
+        try:
+            decoded = SharedDecodedImage(path, np.ndarray(shape, np.uint8, buffer=memory.buf))
+            try:
+                tags = analyzer.analyze(decoded)
+                results.put((task_id, True, tags, decoded.outputs))
+            except Exception as e:
+                results.put((task_id, False, f"{type(e).__name__}: {str(e)}", None))
+            del decoded  # Drop every view of the block before closing it
+        finally:
+            try:
+                memory.close()
+            except BufferError:
+                pass  # An analyzer kept a view; the mapping goes when that is collected
+
+
+class _Worker:
+    def __init__(self, context, name, database, threads, results):
+        self.tasks = context.Queue()
+        self.process = context.Process(target=_worker_main, name=f'analyzer-{name}',
+                                       args=(name, database, threads, self.tasks, results), daemon=True)
+        self.process.start()
+        self.in_flight = set()  # Task ids sent to this worker and not answered yet
+        self.restart_at = None  # Set once it has died: monotonic time to replace it at
+
+    def discard(self):
+        """Free a dead worker's task queue (its feeder thread and pipe) and process handle."""
+        self.tasks.close()
+        self.tasks.cancel_join_thread()  # Nobody will read what is still buffered
+        self.process.close()
+
+
+class AnalyzerPool:
+    """Worker processes running one analyzer, with restarts for the ones that die."""
+
+    def __init__(self, name, database, processes=1, threads=None):
+        self.name = name
+        self.database = database
+        self.threads = threads
+        self._context = multiprocessing.get_context('spawn')  # No torch or Qt state inherited through fork
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._tasks = {}  # task id -> (future, decoded, worker)
+        self._ids = itertools.count()
+        self._crashes = 0
+        self._closed = False
+        self.workers = [self._start() for _ in range(processes)]
+        self._collector = threading.Thread(target=self._collect, name=f'{name}-collector', daemon=True)
+        self._collector.start()
+
+    def _start(self):
+        return _Worker(self._context, self.name, self.database, self.threads, self._results)
+
+    def submit(self, decoded, frame):
+        """Future for analyzer output on frame; decoded.outputs receives the worker's outputs."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} worker pool is closed")
+            live = [worker for worker in self.workers if worker.restart_at is None]
+            if not live:
+                raise RuntimeError(f"{self.name} workers died and are waiting to be restarted")
+            task_id = next(self._ids)
+            worker = min(live, key=lambda worker: len(worker.in_flight))
+            worker.in_flight.add(task_id)
+            self._tasks[task_id] = (future, decoded, worker)
+            QUEUE_DEPTH.labels(f'worker_{self.name}').set(len(self._tasks))
+        worker.tasks.put((task_id, decoded.path, frame.name, frame.shape))
+        return future
+
+    def _collect(self):
+        while not self._closed:
+            try:
+                task_id, ok, value, outputs = self._results.get(timeout=0.5)
+            except queue.Empty:
+                self._supervise()
+                continue
+            with self._lock:
+                entry = self._tasks.pop(task_id, None)
+                if entry is not None:
+                    entry[2].in_flight.discard(task_id)
+                QUEUE_DEPTH.labels(f'worker_{self.name}').set(len(self._tasks))
+            if entry is None:
+                continue  # Already failed by a restart
+            future, decoded, _ = entry
+            self._crashes = 0
+            if ok:
+                decoded.outputs.update(outputs)
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+            self._supervise()
+
+    def _supervise(self):
+        now = time.monotonic()
+        for index, worker in enumerate(self.workers):
+            if self._closed:
+                return
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    WORKER_RESTARTS.labels(self.name).inc()
+                    replacement = self._start()
+                    with self._lock:
+                        self.workers[index] = replacement
+                    worker.discard()
+                continue
+            if worker.process.is_alive():
+                continue
+            # Back off when a worker keeps dying, e.g. on a model it cannot load
+            delay = min(MAX_RESTART_DELAY, RESTART_DELAY * 2 ** self._crashes)
+            self._crashes += 1
+            with self._lock:
+                worker.restart_at = now + delay  # submit() stops choosing it
+                lost = [self._tasks.pop(task_id) for task_id in worker.in_flight if task_id in self._tasks]
+                worker.in_flight.clear()
+            code = worker.process.exitcode
+            logger.error(f"{self.name} worker exited with code {code}, failing {len(lost)} images "
+                         f"and restarting it in {delay:.0f}s")
+            for future, _, _ in lost:
+                future.set_exception(RuntimeError(f"{self.name} worker exited with code {code}"))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            pending = list(self._tasks.values())
+            self._tasks.clear()
+        for worker in self.workers:
+            worker.tasks.put(None)
+        for worker in self.workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for future, _, _ in pending:
+            future.set_exception(RuntimeError(f"{self.name} worker pool closed"))
+        self._collector.join()
+
+
+class IsolatedAnalyzer(Analyzer):
+    """Stands in for an analyzer in the pipeline and runs it in an AnalyzerPool."""
+    asynchronous = True
+
+    def __init__(self, analyzer, pool):
+        self.analyzer = analyzer
+        self.pool = pool
+        self.name = analyzer.name
+        self.enabled = analyzer.enabled
+        self.input_side = analyzer.input_side
+
+    @property
+    def version(self):
+        return self.analyzer.version
+
+    def analyze(self, decoded):
+        side = self.input_side
+        frame = acquire_frame(decoded, side)
+        try:
+            future = self.pool.submit(decoded, frame)
+        except Exception:
+            release_frame(decoded, side)
+            raise
+        future.add_done_callback(lambda _: release_frame(decoded, side))
+        return future
+
+
+def isolate(pipeline, localDB, names=ISOLATABLE, processes=1, threads=None):
+    """Move pipeline's analyzers called names into worker processes.
+
+    Each analyzer gets processes workers using localDB's database. threads is
+    the CPU threads per worker, either one count or a dict by analyzer name
+    (None: the IMAGETAGGER_* thread budget). Returns the pools; close them on
+    shutdown.
+    """
+    pools = []
+    for name in names:
+        analyzer = pipeline.analyzers.get(name)
+        if analyzer is None or name not in ISOLATABLE:
+            raise ValueError(f"Analyzer {name} cannot run in a worker process")
+        worker_threads = threads.get(name) if isinstance(threads, dict) else threads
+        pool = AnalyzerPool(name, localDB.DATABASE, processes, worker_threads)
+        pipeline.analyzers[name] = IsolatedAnalyzer(analyzer, pool)
+        pools.append(pool)
+    return pools
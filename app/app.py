@@ -5,31 +5,39 @@ import subprocess
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QPushButton, 
     QWidget, QLabel, QFileDialog, QListWidget, QLineEdit, QListWidgetItem, 
-    QMessageBox, QMenu, QDialog, QCheckBox
+    QMessageBox, QMenu, QDialog, QCheckBox, QCompleter
 )
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt, QThreadPool, QRunnable, pyqtSlot, QObject, pyqtSignal, QTimer, QEvent
+from PyQt5.QtCore import Qt, QThreadPool, QRunnable, pyqtSlot, QObject, pyqtSignal, QTimer, QEvent, QStringListModel
 import requests
 from PIL import Image
 import io
 import gc
 from .image_cache import ImageCache
-from .localDB import LocalDB
+from .previews import load_preview
+from .localDB import LocalDB, USER_SOURCE
+from .tag_writer import TagWriter
+from .concurrency import GOVERNOR
+from .logging_setup import configure_logging
+from .tag_index import TagVocabulary
 
 from app.face_detect import face_detection_thread
 
 # Create an instance of LocalDB
 localDB = LocalDB()
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG,  # Change to DEBUG to see all logs
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler("./logs/app.log"),  # Log to file
-                        logging.StreamHandler()           # Log to console
-                    ])
+# Set up logging: a background thread writes the file, the console only shows warnings.
+# Set IMAGETAGGER_LOG_LEVEL=DEBUG to see all logs
+configure_logging("./logs/app.log", console=True)
 logger = logging.getLogger(__name__)
 
+PREVIEW_SIZE = 300  # Longest side of the image preview label
+
+def pil_to_pixmap(pil_image):
+    data = pil_image.tobytes()
+    qimage = QImage(data, pil_image.width, pil_image.height, 3 * pil_image.width, QImage.Format_RGB888)
+    return QPixmap.fromImage(qimage.copy())  # copy() detaches from the Python buffer
+
 class ImageLoader(QRunnable):
     class Signals(QObject):
         result = pyqtSignal(object, str)
@@ -43,16 +51,8 @@ class ImageLoader(QRunnable):
     def run(self):
         logger.debug(f"Starting to load image: {self.image_path}")
         try:
-            with Image.open(self.image_path) as pil_image:
-                pil_image.thumbnail((1000, 1000), Image.LANCZOS)
-                if pil_image.mode != 'RGB':
-                    pil_image = pil_image.convert('RGB')
-                buffer = io.BytesIO()
-                pil_image.save(buffer, format="PNG")
-                buffer.seek(0)
-                image_data = buffer.getvalue()
-                qimage = QImage.fromData(image_data)
-                pixmap = QPixmap.fromImage(qimage)
+            # Embedded EXIF preview or a reduced-scale decode, never the full image
+            pixmap = pil_to_pixmap(load_preview(self.image_path, 1000, 400))
             logger.debug(f"Image loaded successfully: {self.image_path}")
             self.signals.result.emit(pixmap, self.image_path)
         except Exception as e:
@@ -61,6 +61,31 @@ class ImageLoader(QRunnable):
         finally:
             gc.collect()
 
+class BackendRequest(QRunnable):
+    """A request to the backend API made off the UI thread; result carries the JSON reply or None."""
+    class Signals(QObject):
+        result = pyqtSignal(object)
+
+    def __init__(self, method, path, json=None, timeout=5):
+        super().__init__()
+        self.method = method
+        self.path = path
+        self.json = json
+        self.timeout = timeout
+        self.signals = self.Signals()
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            response = requests.request(self.method, f"http://localhost:8000{self.path}", json=self.json,
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug(f"Request to {self.path} failed: {str(e)}")
+            payload = None
+        self.signals.result.emit(payload)
+
 class FaceDetectionTask(QRunnable):
     def __init__(self, file_path, localDB):
         super().__init__()
@@ -80,11 +105,15 @@ class ImageTaggerApp(QMainWindow):
 
         self.image_cache = ImageCache(max_size=10)
         self.localDB = LocalDB()  # Initialize LocalDB
+        self.tag_vocabulary = TagVocabulary(self.localDB)  # Tag names and counts for search suggestions
+        self.tag_writer = TagWriter.get(self.localDB)  # Batched tag writes shared with the face thread
         self.stop_server_func = stop_server_func
         self.clear_logs()  # Clear logs when the app starts
         self.processed_images = set()  # Set to track processed images
         self.initUI()  # Initialize the UI components
         self.threadpool = QThreadPool()  # Initialize the thread pool
+        GOVERNOR.register('gui', self.threadpool.setMaxThreadCount)  # Its share of the process thread budget
+        GOVERNOR.apply()
 
     def initUI(self):
         central_widget = QWidget()
@@ -127,6 +156,12 @@ class ImageTaggerApp(QMainWindow):
         search_layout = QHBoxLayout()
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Enter tags to search (comma-separated)")
+        # Suggest known tags for the tag currently being typed
+        self.search_completions = QStringListModel(self)
+        self.search_completer = QCompleter(self.search_completions, self)
+        self.search_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.search_input.setCompleter(self.search_completer)
+        self.search_input.textEdited.connect(self.update_search_suggestions)
         search_layout.addWidget(self.search_input)
         self.search_button = QPushButton("Search")
         self.search_button.clicked.connect(self.search_images)
@@ -169,6 +204,17 @@ class ImageTaggerApp(QMainWindow):
         self.timer.timeout.connect(self.check_processing_status)
         self.processing_attempts = 0
 
+        # Whether a processing run is going, polled from /processing_status until every file is done
+        self.processing_run = False
+        self.run_status_timer = QTimer(self)
+        self.run_status_timer.timeout.connect(self.poll_run_status)
+
+        # Ask the backend to process the rows in view first, once scrolling settles
+        self.visible_bump_timer = QTimer(self)
+        self.visible_bump_timer.setSingleShot(True)
+        self.visible_bump_timer.timeout.connect(self.bump_visible_images)
+        self.image_list.verticalScrollBar().valueChanged.connect(lambda _: self.visible_bump_timer.start(300))
+
         # Add context menu for image list
         self.image_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.image_list.customContextMenuRequested.connect(self.show_context_menu)
@@ -219,7 +265,8 @@ class ImageTaggerApp(QMainWindow):
                     logger.warning(f"Skipping unsupported HEIC file: {file}")
                 elif self.is_supported_image(file):
                     full_path = os.path.join(root, file)
-                    self.localDB.save_tags(file, [], full_path)
+                    self.tag_writer.add(file, USER_SOURCE, [], full_path)  # Register without touching tags
+        self.tag_writer.flush()
         self.update_file_count()
         self.send_folder_to_backend(folder)
         self.load_images()
@@ -231,7 +278,8 @@ class ImageTaggerApp(QMainWindow):
                 logger.warning(f"Skipping unsupported HEIC file: {file}")
             elif self.is_supported_image(file):
                 full_path = os.path.join(folder, file)
-                self.localDB.save_tags(file, [], full_path)
+                self.tag_writer.add(file, USER_SOURCE, [], full_path)  # Register without touching tags
+        self.tag_writer.flush()
         self.update_file_count()
         self.send_folder_to_backend(folder)
         self.load_images()
@@ -262,6 +310,7 @@ class ImageTaggerApp(QMainWindow):
             return
 
         filename = item.text()
+        self.bump_images([filename], "selected")
         file_location = self.localDB.get_file_location(filename)
         
         # If the file is not in the database, assume it's in the selected folder
@@ -285,20 +334,17 @@ class ImageTaggerApp(QMainWindow):
         pixmap = self.image_cache.get(file_location)
         if pixmap is None:
             try:
-                image = QImage(file_location)
-                if image.isNull():
-                    logger.error(f"Failed to load image: {file_location}")
-                    self.image_label.setText("Failed to load image")
-                    return
-                pixmap = QPixmap.fromImage(image)
+                # Twice the label size keeps the preview sharp on high-DPI screens; an
+                # embedded preview at least the label size is good enough
+                pixmap = pil_to_pixmap(load_preview(file_location, 2 * PREVIEW_SIZE, PREVIEW_SIZE))
                 self.image_cache.set(file_location, pixmap)
             except Exception as e:
                 logger.exception(f"Error loading image {file_location}: {str(e)}")
                 self.image_label.setText(f"Error loading image: {str(e)}")
                 return
 
-        max_width = 300  # Set your desired maximum width
-        max_height = 300  # Set your desired maximum height
+        max_width = PREVIEW_SIZE  # Set your desired maximum width
+        max_height = PREVIEW_SIZE  # Set your desired maximum height
         self.image_label.setMaximumSize(max_width, max_height)
         self.image_label.setPixmap(pixmap)
         self.image_label.setScaledContents(True)
@@ -351,8 +397,8 @@ class ImageTaggerApp(QMainWindow):
             if not file_location:
                 file_location = os.path.join(self.selected_folder, filename)
 
-            # Save tags to the database
-            self.localDB.save_tags(filename, tags, file_location)
+            # Save tags to the database; removed tags are dropped from every analyzer's source
+            self.tag_writer.set_tags(filename, tags, file_location).result()
             
             # Update UI
             self.status_label.setText("Tags saved")
@@ -374,6 +420,19 @@ class ImageTaggerApp(QMainWindow):
         except requests.exceptions.RequestException as e:
             logger.error(f"Error connecting to backend: {str(e)}")
 
+    def update_search_suggestions(self, text):
+        # Only the last comma-separated tag is completed; keep the ones before it
+        head, _, current = text.rpartition(',')
+        current = current.strip()
+        if not current:
+            self.search_completions.setStringList([])
+            return
+        head = f"{head}, " if head else ""
+        suggestions = self.tag_vocabulary.autocomplete(current, limit=10)
+        self.search_completions.setStringList([f"{head}{tag}" for tag, _ in suggestions])
+        self.search_completer.setCompletionPrefix(text)
+        self.search_completer.complete()
+
     def search_images(self):
         logger.info("Searching images")
         search_tags = [tag.strip() for tag in self.search_input.text().split(',') if tag.strip()]
@@ -383,7 +442,9 @@ class ImageTaggerApp(QMainWindow):
 
         try:
             # Query the database for images with matching tags
-            matching_images = localDB.search_images(search_tags)  # Now returns (name, file_location)
+            # Returns (name, file_location); misspelled tags also match once the API has
+            # loaded its tag index (IMAGETAGGER_TAG_INDEX=1), and fuzzy is ignored until then
+            matching_images = localDB.search_images(search_tags, fuzzy=True)
             self.image_list.clear()  # Clear the current list
 
             if matching_images:
@@ -409,13 +470,13 @@ class ImageTaggerApp(QMainWindow):
                 self.status_label.setText("Processing started. Please wait...")
                 self.processing_attempts = 0
                 self.timer.start(2000)  # Check every 2 seconds
+                self.processing_run = True
+                self.run_status_timer.start(2000)
+                self.bump_visible_images()  # What is on screen goes first
 
-                # Start face detection in a thread pool for each image
+                # Face detection runs in the backend pipeline on the same decoded pixels
                 for filename in os.listdir(self.selected_folder):
                     if self.is_supported_image(filename):
-                        file_path = os.path.join(self.selected_folder, filename)
-                        task = FaceDetectionTask(file_path, self.localDB)
-                        self.threadpool.start(task)  # Start the task in the thread pool
                         self.processed_images.add(filename)  # Mark the image as processed
 
                 self.update_file_count()  # Update count after processing images
@@ -426,13 +487,45 @@ class ImageTaggerApp(QMainWindow):
             logger.error(f"Error connecting to backend: {str(e)}")
             self.status_label.setText(f"Error connecting to backend: {e}")
 
+    def visible_images(self):
+        viewport = self.image_list.viewport().rect()
+        first = self.image_list.indexAt(viewport.topLeft()).row()
+        last = self.image_list.indexAt(viewport.bottomLeft()).row()
+        if first < 0:
+            return []
+        if last < 0:
+            last = self.image_list.count() - 1
+        return [self.image_list.item(row).text() for row in range(first, last + 1)]
+
+    def bump_visible_images(self):
+        self.bump_images(self.visible_images(), "visible")
+
+    def bump_images(self, filenames, priority):
+        if not filenames or not self.processing_run:  # Only while a processing run is going
+            return
+        # On the thread pool: a slow backend must not stall clicks and scrolling
+        self.threadpool.start(BackendRequest("POST", "/bump", {"filenames": filenames, "priority": priority}))
+
+    def poll_run_status(self):
+        request = BackendRequest("GET", "/processing_status")
+        request.signals.result.connect(self.on_run_status)
+        self.threadpool.start(request)
+
+    def on_run_status(self, status):
+        if status is None:
+            return  # Backend busy or unreachable; try again on the next tick
+        if status["processed"] >= status["total"]:
+            logger.info(f"Processing run finished: {status['processed']} images")
+            self.processing_run = False
+            self.run_status_timer.stop()
+
     def check_processing_status(self):
         logger.debug("Checking processing status")
         try:
             response = requests.get("http://localhost:8000/get_tags")
             if response.status_code == 200:
                 image_tags = response.json()
-                logger.debug(f"Received tags: {image_tags}")
+                logger.debug(f"Received tags for {len(image_tags)} images")
                 if image_tags:  # If tags are available
                     logger.info(f"Processed {len(image_tags)} images")
                     self.status_label.setText(f"Processed {len(image_tags)} images")
@@ -0,0 +1,65 @@
+import os
+import json
+import logging
+import threading
+import torch
+from torchvision.models import resnet50, ResNet50_Weights
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES_PATH = os.path.join(os.path.dirname(__file__), 'imagenet_classes.txt')
+
+# Stamped on the classifier's stored tags so a new model can re-tag only what it changes
+MODEL_WEIGHTS = ResNet50_Weights.DEFAULT
+MODEL_VERSION = f"resnet50/{MODEL_WEIGHTS.name}"
+
+_model = None
+_categories = None
+_load_lock = threading.Lock()
+
+
+def get_model():
+    global _model
+    with _load_lock:
+        if _model is None:
+            logger.info("Loading pre-trained ResNet model")
+            model = resnet50(weights=MODEL_WEIGHTS)
+            model.eval()
+            # preprocess.py hands over channels-last tensors, so keep the weights in the same layout
+            _model = model.to(memory_format=torch.channels_last)
+    return _model
+
+
+def get_categories():
+    global _categories
+    if _categories is None:
+        logger.info("Loading ImageNet class labels")
+        # The label file is a JSON array of 1000 class names
+        with open(CATEGORIES_PATH, "r") as f:
+            _categories = json.load(f)
+    return _categories
+
+
+def _pooled_features(model, x):
+    # ResNet.forward without the final fc layer
+    x = model.maxpool(model.relu(model.bn1(model.conv1(x))))
+    x = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+    return torch.flatten(model.avgpool(x), 1)
+
+
+def classify_and_embed(input_batch, top_k=5):
+    """Return the top_k ImageNet class names and the 2048-d pooled feature vector."""
+    model = get_model()
+    with torch.no_grad():
+        features = _pooled_features(model, input_batch)
+        output = model.fc(features)
+
+    probabilities = torch.nn.functional.softmax(output[0], dim=0)
+    top_prob, top_catid = torch.topk(probabilities, top_k)
+    categories = get_categories()
+    return [categories[idx] for idx in top_catid], features[0].numpy()
+
+
+def classify(input_batch, top_k=5):
+    """Return the top_k ImageNet class names for a single-image input batch."""
+    return classify_and_embed(input_batch, top_k)[0]
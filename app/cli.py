@@ -0,0 +1,315 @@
+"""Headless bulk tagging.
+
+Tag a directory tree without the GUI or the API server, optionally as one
+shard of several so multiple machines can split an archive:
+
+    python -m app.cli tag /archive --workers 8
+    python -m app.cli tag /archive --shard 0/4 --workers 8   # on machine 1 of 4
+    python -m app.cli merge data/image_tags.shard-*-of-4.db
+    python -m app.cli retag --analyzers classifier       # after a model upgrade
+
+Each shard writes its own database (and embedding matrix); merge folds them
+into the main catalog. retag re-runs an analyzer only on the images whose
+stored output came from a different version of it.
+
+The catalog keys images by file name, so two files with the same name in
+different directories (2023/IMG_0001.JPG and 2024/IMG_0001.JPG) cannot both
+be tagged: the first one in walk order keeps the name and the others are
+reported as failed, as are files whose name a different file already holds
+in the database. merge refuses such images the same way.
+"""
+import os
+import sys
+import time
+import zlib
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .localDB import LocalDB
+from .embedding_store import EmbeddingStore, EMBEDDINGS_PATH
+from .pipeline import SUPPORTED_EXTENSIONS, MAX_DECODE_PIXELS, MAX_INFLIGHT_PIXELS, default_pipeline, save_result
+from .tag_writer import TagWriter
+from .concurrency import ThreadBudget
+from .logging_setup import configure_logging, ProgressSummary
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANALYZERS = 'phash,classifier,colors,faces,embedded,ocr'
+
+
+def parse_shard(value):
+    """'i/n' -> (i, n) with 0 <= i < n."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like i/n, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def shard_database(shard):
+    index, count = shard
+    root, extension = os.path.splitext(LocalDB.DATABASE)
+    return f"{root}.shard-{index}-of-{count}{extension}"
+
+
+def embeddings_path(database):
+    if os.path.abspath(database) == os.path.abspath(LocalDB.DATABASE):
+        return EMBEDDINGS_PATH
+    return os.path.splitext(database)[0] + '.embeddings.f16'
+
+
+def find_images(root, shard=None, duplicates=None):
+    """Supported images under root, in a stable order, restricted to one shard.
+
+    A file whose name an earlier file in the walk already has is not yielded;
+    (path, earlier path) is appended to duplicates instead. Every shard walks
+    the whole tree, so all shards agree on which file keeps the name.
+    """
+    first_paths = {}  # file name -> first path with it
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            path = os.path.join(directory, filename)
+            if shard is not None:
+                # crc32 of the relative path is stable across machines and runs
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                in_shard = zlib.crc32(relative.encode('utf-8')) % shard[1] == shard[0]
+            else:
+                in_shard = True
+            first_path = first_paths.setdefault(filename, path)
+            if first_path != path:
+                if in_shard and duplicates is not None:
+                    duplicates.append((path, first_path))
+                continue
+            if in_shard:
+                yield path
+
+
+# Per-worker-process pipeline, built once by _init_worker
+_worker_pipeline = None
+
+
+def build_pipeline(database, analyzers, max_decode_pixels):
+    pipeline = default_pipeline(LocalDB(database=database))
+    for name, analyzer in pipeline.analyzers.items():
+        analyzer.enabled = name in analyzers
+    pipeline.max_decode_pixels = max_decode_pixels
+    pipeline.admission = None  # The parent process admits work for all workers
+    return pipeline
+
+
+def _init_worker(database, analyzers, ocr_workers, max_decode_pixels, threads):
+    global _worker_pipeline
+    # Each worker gets its slice of the machine instead of torch and OpenCV taking every core
+    ThreadBudget.from_env(total=threads).apply()
+    _worker_pipeline = build_pipeline(database, analyzers, max_decode_pixels)
+    _worker_pipeline.analyzers['ocr'].workers = ocr_workers
+
+
+def _process_file(path, only=None):
+    return _worker_pipeline.process(path, only)
+
+
+def parse_analyzers(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def tag(args):
+    database = args.db or (shard_database(args.shard) if args.shard else LocalDB.DATABASE)
+    analyzers = parse_analyzers(args.analyzers)
+    # Header reads only, to charge each file its decoded size before submitting it
+    planner = build_pipeline(database, analyzers, args.max_decode_pixels)
+    duplicates = []
+    jobs = ((path, None) for path in find_images(args.directory, args.shard, duplicates))
+    logger.info(f"Tagging {args.directory} into {database} with {args.workers} workers, analyzers: {sorted(analyzers)}")
+    status = _run(args, database, analyzers, planner, jobs)
+    for path, first_path in duplicates:
+        logger.error(f"Error processing {path}: the catalog keys images by file name and {first_path} has the same name")
+    if duplicates:
+        logger.error(f"{len(duplicates)} images were not tagged because another file has their name; rename them and run again")
+    return 1 if duplicates else status
+
+
+def retag(args):
+    database = args.db or LocalDB.DATABASE
+    analyzers = parse_analyzers(args.analyzers)
+    planner = build_pipeline(database, analyzers, args.max_decode_pixels)
+    unknown = analyzers - set(planner.analyzers)
+    if unknown:
+        logger.error(f"Unknown analyzers: {sorted(unknown)}")
+        return 2
+    versions = planner.versions(analyzers)
+    stale = LocalDB(database=database).stale_images(versions)
+    logger.info(f"{len(stale)} images in {database} have outputs older than {versions}")
+    if args.dry_run:
+        return 0
+    jobs = ((file_location, sources) for _, file_location, sources in stale)
+    return _run(args, database, analyzers, planner, jobs)
+
+
+def _run(args, database, analyzers, planner, jobs):
+    """Process (path, analyzers to run or None for all) jobs in worker processes and save the results."""
+    localDB = LocalDB(database=database)
+    embedding_store = EmbeddingStore(embeddings_path(database))
+    threads_per_worker = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    start = time.perf_counter()
+    summary = ProgressSummary(logger, "Tagging")
+    done = failed = 0
+    # spawn: each worker loads its own model instead of inheriting torch state through fork
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(database, analyzers, args.ocr_workers, args.max_decode_pixels,
+                                       threads_per_worker)) as executor:
+        pending = {}  # future -> (path, decoded pixels)
+        for path, only in jobs:
+            holder = _name_holder(localDB, path)
+            if holder is not None:
+                logger.error(f"Error processing {path}: the catalog already has {holder} under the same file name")
+                failed += 1
+                continue
+            pixels = _decode_cost(planner, path, only)
+            if pixels > args.max_inflight_pixels:
+                logger.error(f"Error processing {path}: {pixels} decoded pixels exceed --max-inflight-pixels")
+                failed += 1
+                continue
+            # Bound the in-flight work so huge archives do not queue millions of futures,
+            # and hold back big files while the ones in flight would not leave room for them
+            while pending and (len(pending) >= args.workers * 4 or
+                               _in_flight(pending) + pixels > args.max_inflight_pixels):
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done, failed = _store(finished, pending, localDB, embedding_store, done, failed)
+                summary.update(done + failed)
+            pending[executor.submit(_process_file, path, only)] = (path, pixels)
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            done, failed = _store(finished, pending, localDB, embedding_store, done, failed)
+            summary.update(done + failed)
+
+    TagWriter.get(localDB).flush()
+    embedding_store.flush()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Tagged {done} images ({failed} failed) in {elapsed:.1f}s")
+    return 1 if failed and not done else 0
+
+
+def _name_holder(localDB, path):
+    """The other, still existing file the catalog stores under path's file name, if any.
+
+    A stored location that no longer exists is taken to be this file before it moved.
+    """
+    location = localDB.get_file_location(os.path.basename(path))
+    if not location or os.path.abspath(location) == os.path.abspath(path) or not os.path.exists(location):
+        return None
+    if os.path.exists(path) and os.path.samefile(location, path):
+        return None
+    return location
+
+
+def _decode_cost(pipeline, path, only=None):
+    try:
+        with pipeline.open(path, only) as image:
+            return image.width * image.height
+    except Exception:
+        return 0  # Unreadable or too large; the worker will report the error
+
+
+def _in_flight(pending):
+    return sum(pixels for _, pixels in pending.values())
+
+
+def _store(finished, pending, localDB, embedding_store, done, failed):
+    for future in finished:
+        path, _ = pending.pop(future)
+        try:
+            save_result(localDB, future.result(), embedding_store, wait=False)
+            done += 1
+        except Exception as e:
+            logger.error(f"Error processing {path}: {str(e)}")
+            failed += 1
+    return done, failed
+
+
+def merge(args):
+    target = LocalDB(database=args.into)
+    target_embeddings = EmbeddingStore(embeddings_path(args.into))
+    refused = 0
+    for shard in args.shards:
+        if os.path.abspath(shard) == os.path.abspath(args.into):
+            logger.warning(f"Skipping {shard}: it is the merge target")
+            continue
+        conflicts = []
+        id_map = target.merge_from(shard, conflicts)
+        for image_name, location, other_location in conflicts:
+            logger.error(f"Not merging {image_name} from {shard}: it is {other_location} there "
+                         f"but {location} in {args.into}")
+        refused += len(conflicts)
+        shard_embeddings_path = embeddings_path(shard)
+        copied = 0
+        if os.path.exists(shard_embeddings_path):
+            shard_embeddings = EmbeddingStore(shard_embeddings_path)
+            for shard_id, merged_id in id_map:
+                vector = shard_embeddings.get(shard_id)
+                if vector is not None:
+                    target_embeddings.put(merged_id, vector)
+                    copied += 1
+        logger.info(f"Merged {len(id_map)} images and {copied} embeddings from {shard}")
+    target_embeddings.flush()
+    return 1 if refused else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.cli', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    tag_parser = commands.add_parser('tag', help="Run the analysis pipeline over a directory tree")
+    tag_parser.add_argument('directory')
+    tag_parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                            help="Worker processes, each with its own model")
+    tag_parser.add_argument('--shard', type=parse_shard, help="Process only shard i of n, e.g. 0/4")
+    tag_parser.add_argument('--db', help="Database to write (default: per-shard file, or the main catalog)")
+    tag_parser.add_argument('--analyzers', default=DEFAULT_ANALYZERS, help="Comma-separated analyzers to run")
+    tag_parser.add_argument('--ocr-workers', type=int, default=1, help="Tesseract processes per worker")
+    tag_parser.add_argument('--threads-per-worker', type=int,
+                            help="CPU threads each worker splits between torch and OpenCV "
+                            "(default: cores / workers; each pool keeps at least one)")
+    tag_parser.add_argument('--max-decode-pixels', type=int, default=MAX_DECODE_PIXELS,
+                            help="Largest decode per image; bigger files are decoded at reduced scale")
+    tag_parser.add_argument('--max-inflight-pixels', type=int, default=MAX_INFLIGHT_PIXELS,
+                            help="Decoded pixels allowed across all workers at once")
+    tag_parser.set_defaults(func=tag)
+
+    retag_parser = commands.add_parser('retag', help="Re-run analyzers whose stored outputs are from another version")
+    retag_parser.add_argument('--db', help="Database to update (default: the main catalog)")
+    retag_parser.add_argument('--analyzers', default=DEFAULT_ANALYZERS, help="Comma-separated analyzers to check")
+    retag_parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                              help="Worker processes, each with its own model")
+    retag_parser.add_argument('--ocr-workers', type=int, default=1, help="Tesseract processes per worker")
+    retag_parser.add_argument('--threads-per-worker', type=int,
+                              help="CPU threads each worker splits between torch and OpenCV "
+                              "(default: cores / workers; each pool keeps at least one)")
+    retag_parser.add_argument('--max-decode-pixels', type=int, default=MAX_DECODE_PIXELS,
+                              help="Largest decode per image; bigger files are decoded at reduced scale")
+    retag_parser.add_argument('--max-inflight-pixels', type=int, default=MAX_INFLIGHT_PIXELS,
+                              help="Decoded pixels allowed across all workers at once")
+    retag_parser.add_argument('--dry-run', action='store_true', help="Only report how many images are stale")
+    retag_parser.set_defaults(func=retag)
+
+    merge_parser = commands.add_parser('merge', help="Combine shard databases into the main catalog")
+    merge_parser.add_argument('shards', nargs='+')
+    merge_parser.add_argument('--into', default=LocalDB.DATABASE)
+    merge_parser.set_defaults(func=merge)
+
+    args = parser.parse_args(argv)
+    configure_logging(console=True, console_level=logging.INFO)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""One CPU thread budget for every pool in the process.
+
+torch's intra-op pool, OpenCV's internal threads, the tesseract processes and
+the GUI's QThreadPool each size themselves to the whole machine by default;
+in one run.py process they oversubscribe the cores several times over.
+ThreadBudget splits a single core count between them and applies the split.
+
+Configuration comes from the environment:
+
+    IMAGETAGGER_THREADS=8                          # cores to share (default: all)
+    IMAGETAGGER_THREAD_WEIGHTS=torch=4,opencv=2,ocr=2
+    IMAGETAGGER_IO_THREADS=db=8,gui=4              # mostly waiting, not computing
+
+autotune() moves the CPU split toward the pools whose pipeline stages took
+the most time since the previous call.
+"""
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {'torch': 4, 'opencv': 2, 'ocr': 2}
+DEFAULT_IO_THREADS = {'db': 8, 'gui': 4}
+# Pipeline stage -> CPU pool its time is spent in
+STAGE_POOLS = {'classifier': 'torch', 'faces': 'opencv', 'ocr': 'ocr'}
+
+
+def _parse_counts(value):
+    counts = {}
+    for part in value.split(','):
+        if '=' in part:
+            name, count = part.split('=', 1)
+            counts[name.strip()] = float(count)
+    return counts
+
+
+def _set_torch_threads(count):
+    import torch
+    torch.set_num_threads(count)
+
+
+def _set_opencv_threads(count):
+    import cv2
+    cv2.setNumThreads(count)
+
+
+class ThreadBudget:
+    def __init__(self, total=None, weights=None, io_threads=None):
+        self.total = max(1, total or os.cpu_count() or 1)
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.io_threads = dict(io_threads or DEFAULT_IO_THREADS)
+        self._lock = threading.Lock()
+        self._consumers = {'torch': [_set_torch_threads], 'opencv': [_set_opencv_threads]}
+        self._last_totals = {}
+        self.applied = {}
+
+    @classmethod
+    def from_env(cls, environ=os.environ, total=None):
+        """Budget from the IMAGETAGGER_* variables; an explicit total wins over IMAGETAGGER_THREADS."""
+        if total is None and environ.get('IMAGETAGGER_THREADS'):
+            total = int(environ['IMAGETAGGER_THREADS'])
+        weights = dict(DEFAULT_WEIGHTS)
+        weights.update(_parse_counts(environ.get('IMAGETAGGER_THREAD_WEIGHTS', '')))
+        io_threads = dict(DEFAULT_IO_THREADS)
+        io_threads.update({name: int(count) for name, count in
+                           _parse_counts(environ.get('IMAGETAGGER_IO_THREADS', '')).items()})
+        return cls(total, weights, io_threads)
+
+    def allocation(self):
+        """Threads per pool: the CPU pools share total by weight, I/O pools get fixed counts.
+
+        The CPU counts add up to total, except that every CPU pool keeps at
+        least one thread: below len(weights) cores each pool gets exactly one.
+        """
+        with self._lock:
+            weight_sum = sum(self.weights.values()) or 1
+            shares = {name: self.total * weight / weight_sum for name, weight in self.weights.items()}
+            counts = {name: max(1, int(share)) for name, share in shares.items()}
+            by_remainder = sorted(shares, key=lambda name: shares[name] - int(shares[name]), reverse=True)
+            leftover = self.total - sum(counts.values())
+            # Hand leftover cores to the largest remainders so the split adds up to total
+            for name in by_remainder[:max(0, leftover)]:
+                counts[name] += 1
+            # Pools raised to their minimum of one overshoot total; take the
+            # excess back from the pools with the smallest remainders
+            while leftover < 0:
+                donors = [name for name in reversed(by_remainder) if counts[name] > 1]
+                if not donors:
+                    break
+                counts[donors[0]] -= 1
+                leftover += 1
+            counts.update(self.io_threads)
+            return counts
+
+    def threads(self, pool):
+        return self.allocation().get(pool, 1)
+
+    def register(self, pool, callback):
+        """Call callback(thread count) now and whenever the pool's share changes."""
+        with self._lock:
+            self._consumers.setdefault(pool, []).append(callback)
+            count = self.applied.get(pool)
+        if count is not None:
+            callback(count)
+
+    def apply(self):
+        allocation = self.allocation()
+        with self._lock:
+            consumers = {pool: list(callbacks) for pool, callbacks in self._consumers.items()}
+            applied = dict(self.applied)
+        for pool, count in allocation.items():
+            if applied.get(pool) == count:
+                continue
+            for callback in consumers.get(pool, ()):
+                try:
+                    callback(count)
+                except ImportError:
+                    pass  # Library not installed in this process
+                except Exception as e:
+                    logger.warning(f"Could not give {pool} {count} threads: {str(e)}")
+            with self._lock:
+                self.applied[pool] = count
+        logger.info(f"Thread budget of {self.total} cores: {allocation}")
+        return allocation
+
+    def autotune(self, snapshot, smoothing=0.5):
+        """Reweight the CPU pools by the stage time recorded since the last call.
+
+        snapshot is Pipeline.stats.snapshot(). The new weight of a pool is a blend
+        of its old weight and its share of the recent stage time, so a stage
+        that keeps dominating gets more threads until the times even out.
+        """
+        demand = dict.fromkeys(self.weights, 0.0)
+        for stage, stats in snapshot.items():
+            pool = STAGE_POOLS.get(stage)
+            if pool in demand:
+                demand[pool] += stats['total_seconds'] - self._last_totals.get(stage, 0.0)
+                self._last_totals[stage] = stats['total_seconds']
+        recent = sum(demand.values())
+        if recent <= 0:
+            return self.allocation()
+        with self._lock:
+            weight_sum = sum(self.weights.values()) or 1
+            self.weights = {
+                pool: smoothing * weight / weight_sum + (1 - smoothing) * demand[pool] / recent
+                for pool, weight in self.weights.items()
+            }
+        return self.apply()
+
+
+# Shared by the API and the GUI when they run in one process
+GOVERNOR = ThreadBudget.from_env()
@@ -0,0 +1,28 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .localDB import use_thread_connections
+
+DEFAULT_DB_THREADS = 8
+
+
+class DBExecutor:
+    """Runs blocking LocalDB calls on a bounded thread pool for async endpoints.
+
+    Every pool thread keeps its own SQLite connection, so a call costs a
+    queue hop instead of a connect, and the event loop keeps serving other
+    requests while a query runs.
+    """
+
+    def __init__(self, max_workers=DEFAULT_DB_THREADS):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='localdb',
+                                           initializer=use_thread_connections)
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
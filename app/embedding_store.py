@@ -0,0 +1,180 @@
+import os
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_PATH = 'data/embeddings.f16'
+EMBEDDING_DIM = 2048
+SEARCH_CHUNK = 8192  # Rows upcast to float32 at a time during a scan
+FLUSH_EVERY = 256
+
+
+class EmbeddingStore:
+    """Memory-mapped float16 matrix of L2-normalized image embeddings.
+
+    Row i belongs to the image whose catalog id (images.id) is i, so a dot
+    product with a normalized query is the cosine similarity. A companion
+    '.valid' file marks which rows hold a vector. build_clusters() adds an
+    optional coarse k-means partition that lets search() scan only the
+    clusters nearest to the query.
+    """
+
+    def __init__(self, path=EMBEDDINGS_PATH, dim=EMBEDDING_DIM):
+        self.path = path
+        self.dim = dim
+        self.valid_path = path + '.valid'
+        self.centroids_path = path + '.centroids.npy'
+        self.assignments_path = path + '.assignments.npy'
+        self._lock = threading.RLock()
+        self._unflushed = 0
+        self.matrix = None
+        self.valid = None
+        self.centroids = None
+        self.assignments = None
+        self._open()
+
+    def _open(self):
+        rows = 0
+        if os.path.exists(self.path):
+            rows = os.path.getsize(self.path) // (2 * self.dim)
+        if rows:
+            self.matrix = np.memmap(self.path, dtype=np.float16, mode='r+', shape=(rows, self.dim))
+            self.valid = np.memmap(self.valid_path, dtype=np.uint8, mode='r+', shape=(rows,))
+        if os.path.exists(self.centroids_path) and os.path.exists(self.assignments_path):
+            self.centroids = np.load(self.centroids_path)
+            self.assignments = np.load(self.assignments_path)
+            self.assignments = self._padded(self.assignments, rows, -1)
+
+    @property
+    def capacity(self):
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def _padded(self, array, rows, fill):
+        if len(array) >= rows:
+            return array
+        padded = np.full(rows, fill, dtype=array.dtype)
+        padded[:len(array)] = array
+        return padded
+
+    def _grow(self, rows):
+        # Double the capacity so appends stay amortized O(1)
+        rows = max(rows, 2 * self.capacity, 1024)
+        self.flush()
+        self.matrix = self.valid = None
+        for path, row_bytes in ((self.path, 2 * self.dim), (self.valid_path, 1)):
+            with open(path, 'ab') as f:
+                f.truncate(rows * row_bytes)
+        self._open()
+
+    def put(self, image_id, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        with self._lock:
+            if image_id >= self.capacity:
+                self._grow(image_id + 1)
+            self.matrix[image_id] = vector / norm
+            self.valid[image_id] = 1
+            if self.centroids is not None:
+                self.assignments[image_id] = int(np.argmax(self.centroids @ (vector / norm)))
+            self._unflushed += 1
+            if self._unflushed >= FLUSH_EVERY:
+                self.flush()
+
+    def get(self, image_id):
+        with self._lock:
+            if image_id >= self.capacity or not self.valid[image_id]:
+                return None
+            return np.asarray(self.matrix[image_id], dtype=np.float32)
+
+    def flush(self):
+        with self._lock:
+            if self.matrix is not None:
+                self.matrix.flush()
+                self.valid.flush()
+            if self.assignments is not None:
+                np.save(self.assignments_path, self.assignments)
+            self._unflushed = 0
+
+    def clear(self):
+        with self._lock:
+            self.matrix = self.valid = self.centroids = self.assignments = None
+            for path in (self.path, self.valid_path, self.centroids_path, self.assignments_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _scores(self, rows, query):
+        # float16 has no BLAS path, so upcast one chunk at a time
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_CHUNK):
+            chunk = rows[start:start + SEARCH_CHUNK]
+            scores[start:start + len(chunk)] = self.matrix[chunk].astype(np.float32) @ query
+        return scores
+
+    def search(self, query, k=10, exclude=None, nprobe=None):
+        """Return up to k (image_id, score) pairs, best first.
+
+        With clusters built, only the nprobe clusters nearest to the query
+        are scanned; nprobe=None scans every valid row.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            if self.matrix is None:
+                return []
+            if nprobe and self.centroids is not None:
+                nearest = np.argsort(self.centroids @ query)[::-1][:nprobe]
+                rows = np.flatnonzero(np.isin(self.assignments, nearest) & (self.valid != 0))
+            else:
+                rows = np.flatnonzero(self.valid)
+            if exclude is not None:
+                rows = rows[rows != exclude]
+            if len(rows) == 0:
+                return []
+            scores = self._scores(rows, query)
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def build_clusters(self, n_clusters=256, iterations=10, sample_size=50000, seed=0):
+        """Run k-means on a sample of the stored vectors and assign every row to a cluster."""
+        with self._lock:
+            if self.matrix is None:
+                return 0
+            rows = np.flatnonzero(self.valid)
+            n_clusters = min(n_clusters, len(rows))
+            if n_clusters == 0:
+                return 0
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(rows, size=min(sample_size, len(rows)), replace=False))
+            vectors = self.matrix[sample].astype(np.float32)
+
+        # Spherical k-means: vectors are normalized, so use cosine assignment
+        centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(vectors @ centroids.T, axis=1)
+            # One-hot matmul sums each cluster's members far faster than np.add.at
+            members = np.zeros((len(labels), n_clusters), dtype=np.float32)
+            members[np.arange(len(labels)), labels] = 1
+            sums = members.T @ vectors
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+
+        with self._lock:
+            assignments = np.full(self.capacity, -1, dtype=np.int32)
+            rows = np.flatnonzero(self.valid)
+            for start in range(0, len(rows), SEARCH_CHUNK):
+                chunk = rows[start:start + SEARCH_CHUNK]
+                assignments[chunk] = np.argmax(self.matrix[chunk].astype(np.float32) @ centroids.T, axis=1)
+            self.centroids = centroids
+            self.assignments = assignments
+            np.save(self.centroids_path, centroids)
+            np.save(self.assignments_path, assignments)
+        logger.info(f"Built {n_clusters} embedding clusters over {len(rows)} images")
+        return n_clusters
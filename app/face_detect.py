@@ -1,49 +1,87 @@
 import cv2
 import os
 import time
+import threading
 import logging
 import numpy as np
+from PIL import Image
 from .localDB import LocalDB
+from .tag_writer import TagWriter
 
-# Set up logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler('logs/face_detection.log')  # Log to a file
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 # Load the gender detection model
 gender_net = cv2.dnn.readNetFromCaffe('facial_detection/gender_deploy.prototxt', 'facial_detection/gender_net.caffemodel')
 gender_list = ['Male', 'Female']
+gender_lock = threading.Lock()  # setInput/forward on a shared net must not interleave
+
+# CascadeClassifier is not thread-safe, so each thread gets its own copy
+_local = threading.local()
+
+def get_face_cascade():
+    if not hasattr(_local, 'face_cascade'):
+        _local.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _local.face_cascade
+
+def detect_faces_in_gray(gray):
+    return get_face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+DETECT_SIZE = 1080  # Shorter side detect_faces decodes at, when the file is bigger
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale
+_REDUCED_READS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def _read_flags(image_path, min_side=DETECT_SIZE):
+    try:
+        with Image.open(image_path) as header:
+            shorter = min(header.size)
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flags in _REDUCED_READS:
+        if shorter // factor >= min_side:
+            return flags
+    return cv2.IMREAD_COLOR
 
 def detect_faces(image_path):
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
-    # Load the image
-    image = cv2.imread(image_path)
+    # Load the image, at reduced scale if it is much bigger than detection needs
+    image = cv2.imread(image_path, _read_flags(image_path))
     if image is None:
         logger.error(f"Image not found: {image_path}")
         return None, None  # Return None for both if the image is not found
 
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    faces = detect_faces_in_gray(gray)
 
     if len(faces) > 0:
-        logger.info(f"Detected {len(faces)} face(s) in {image_path}")
+        logger.debug(f"Detected {len(faces)} face(s) in {image_path}")
     else:
-        logger.info(f"No faces detected in {image_path}")
+        logger.debug(f"No faces detected in {image_path}")
 
     return faces, image  # Return detected faces and the image
 
 def classify_gender(face_image):
     # Prepare the image for gender classification
     blob = cv2.dnn.blobFromImage(face_image, 1.0, (227, 227), (104.0, 177.0, 123.0))
-    gender_net.setInput(blob)
-    gender_preds = gender_net.forward()
+    with gender_lock:
+        gender_net.setInput(blob)
+        gender_preds = gender_net.forward()
     gender = gender_list[gender_preds[0].argmax()]  # Get the gender with the highest probability
     return gender
 
+def face_tags(rgb_pixels):
+    """Return 'face' and gender tags for an already decoded RGB pixel array."""
+    gray = cv2.cvtColor(rgb_pixels, cv2.COLOR_RGB2GRAY)
+    faces = detect_faces_in_gray(gray)
+    tags = []
+    for (x, y, w, h) in faces:
+        # The gender net was trained on BGR input
+        face_image = cv2.cvtColor(rgb_pixels[y:y+h, x:x+w], cv2.COLOR_RGB2BGR)
+        gender = classify_gender(face_image)
+        for tag in ('face', gender.lower()):
+            if tag not in tags:
+                tags.append(tag)
+    return tags
+
 def face_detection_thread(image_path, localDB):
     logger.info(f"Starting face detection for {image_path}")
     while True:
@@ -55,16 +93,11 @@ def face_detection_thread(image_path, localDB):
         for (x, y, w, h) in faces:
             face_image = image[y:y+h, x:x+w]  # Extract the face region
             gender = classify_gender(face_image)  # Classify gender
-            logger.info(f"Detected {gender} in {image_path}")
-
-            # If a face is detected, add the 'face' and gender tags
-            existing_tags = localDB.get_tags(os.path.basename(image_path))
-            if 'face' not in existing_tags:
-                existing_tags.append('face')
-            if gender.lower() not in existing_tags:
-                existing_tags.append(gender.lower())  # Add 'male' or 'female' tag
+            logger.debug(f"Detected {gender} in {image_path}")
 
-            localDB.save_tags(os.path.basename(image_path), existing_tags, image_path)
-            logger.info(f"Added tags to {image_path}: {existing_tags}")
+            # If a face is detected, add the 'face' and gender tags ('male' or 'female')
+            face_tags = ['face', gender.lower()]
+            TagWriter.get(localDB).add(os.path.basename(image_path), 'faces', face_tags, image_path)
+            logger.debug(f"Added tags to {image_path}: {face_tags}")
 
         time.sleep(5)  # Check every 5 seconds
@@ -1,17 +1,23 @@
 from collections import OrderedDict
-from PyQt5.QtGui import QPixmap
 import os
 import json
+import hashlib
+from .metrics import cache_result
+
+FINGERPRINT_CHUNK = 64 * 1024
 
 # Define the cache path
 CACHE_PATH = os.path.join(os.path.dirname(__file__), '../data/image_cache.json')
 
 class ImageCache:
-    def __init__(self, max_size=10):
+    def __init__(self, max_size=10, name='preview'):
         self.max_size = max_size
+        self.name = name  # Label for cache hit/miss metrics; None to skip them
         self.cache = OrderedDict()
 
     def get(self, key):
+        if self.name is not None:
+            cache_result(self.name, key in self.cache)
         if key in self.cache:
             # Move the accessed item to the end (most recently used)
             self.cache.move_to_end(key)
@@ -47,4 +53,15 @@ def load_cache():
 
 def save_cache(data):
     with open(CACHE_PATH, 'w') as f:
-        json.dump(data, f)
\ No newline at end of file
+        json.dump(data, f)
+
+def file_fingerprint(path):
+    """Content fingerprint from the file size and its first and last 64 KiB."""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_CHUNK))
+        if size > FINGERPRINT_CHUNK:
+            f.seek(max(FINGERPRINT_CHUNK, size - FINGERPRINT_CHUNK))
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
@@ -1,13 +1,120 @@
 import sqlite3
 from sqlite3 import Error
 from PIL import Image
-from colorthief import ColorThief
+import numpy as np
 import os
+import time
+import zlib
+import threading
+from collections import OrderedDict, namedtuple
+from .metrics import DB_SECONDS, timed_db, cache_result
+from .image_cache import ImageCache
+from .palette import extract_palette
+
+SEARCH_CACHE_SIZE = 256
+SQL_BATCH_SIZE = 500  # Names bound per IN (...) query; SQLite allows 999 variables in older builds
+COLOR_SAMPLE_SIZE = 400  # Longest side files are reduced to before palette extraction
+
+# Tags are stored per source (an analyzer name, 'user', ...); images.tags is their union
+USER_SOURCE = 'user'
+LEGACY_SOURCE = 'legacy'  # Tags that predate per-source storage
+
+# op is 'add', 'remove', 'replace' or 'set'. remove with source None removes from
+# every source; set makes the union equal tags, adding new ones to source.
+# replace also stamps the source with version, the analyzer version that produced it.
+TagMutation = namedtuple('TagMutation', 'name op source tags file_location version', defaults=(None,))
+
+# Per-thread connections for threads that called use_thread_connections()
+_thread_state = threading.local()
+
+class _ThreadConnection(sqlite3.Connection):
+    """A connection kept open for the life of its thread.
+
+    close() only ends an open transaction, as a real close would, so methods
+    written for one connection per call can reuse it unchanged.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+def use_thread_connections():
+    """Make LocalDB reuse one connection per database on the calling thread.
+
+    Meant as a thread pool initializer; sqlite3 connections cannot be shared
+    between threads, but a worker thread can keep its own.
+    """
+    _thread_state.connections = {}
+
+def split_tags(tags_str):
+    return tags_str.split(', ') if tags_str else []
+
+def union_tags(tag_lists):
+    merged = []
+    for tags in tag_lists:
+        for tag in tags:
+            if tag not in merged:
+                merged.append(tag)
+    return merged
+
+def apply_mutation(sources, mutation, versions=None):
+    """Apply one TagMutation to an OrderedDict of source -> tags, and to a dict of
+    source -> version if given, in place. Sources left empty stay as empty lists."""
+    tags = union_tags([mutation.tags])
+    if mutation.op == 'replace':
+        sources[mutation.source] = tags
+        if versions is not None:
+            versions[mutation.source] = mutation.version
+    elif mutation.op == 'add':
+        if tags:
+            current = sources.setdefault(mutation.source, [])
+            current.extend(tag for tag in tags if tag not in current)
+    elif mutation.op == 'remove':
+        removed = set(tags)
+        for source in ([mutation.source] if mutation.source else list(sources)):
+            if source in sources:
+                sources[source] = [tag for tag in sources[source] if tag not in removed]
+    elif mutation.op == 'set':
+        current = union_tags(sources.values())
+        apply_mutation(sources, mutation._replace(op='remove', source=None, tags=set(current) - set(tags)))
+        apply_mutation(sources, mutation._replace(op='add', tags=[tag for tag in tags if tag not in current]))
+    else:
+        raise ValueError(f"Unknown tag mutation: {mutation.op}")
+
+def normalize_search_tags(tags):
+    """Canonical form of a search: LIKE is case-insensitive for ASCII and OR ignores order."""
+    normalized = set()
+    for tag in tags:
+        tag = tag.strip()
+        if tag:
+            normalized.add(tag.lower() if tag.isascii() else tag)
+    return tuple(sorted(normalized))
 
 class LocalDB:
     DATABASE = 'data/image_tags.db'
+    reset_callbacks = []  # Called after reset_database, e.g. to drop data keyed by image id
+    # Called as listener(database, image_name, old_tags, new_tags, file_location) after tag writes commit
+    tag_listeners = []
+    # Optional in-memory tag indexes by database path; search_images uses them instead of SQL
+    tag_indexes = {}
+    # Optional in-memory copies by database path (app.read_replica); reads are served from them
+    read_replicas = {}
+    # Optional trigram indexes of the tag vocabulary by database path, for fuzzy searches
+    trigram_indexes = {}
+    # Shared by every instance in the process (the GUI and the API each hold one).
+    # Entries are (write generation, results) keyed by database and normalized query;
+    # any catalog write bumps the generation, which makes older entries misses.
+    _search_cache = ImageCache(max_size=SEARCH_CACHE_SIZE, name=None)
+    _write_generations = {}  # database path -> generation
+    _cache_lock = threading.Lock()
+    # Columns added after the original schema; create_table adds them to older databases
+    EXTRA_COLUMNS = {
+        'phash': 'INTEGER',  # 64-bit perceptual hash, stored signed
+    }
 
-    def __init__(self):
+    def __init__(self, database=None):
+        if database is not None:
+            self.DATABASE = database  # e.g. a shard or benchmark database
         self.initialize_db()
         self.color_rgb_values = [
             (255, 0, 0),      # red
@@ -123,6 +230,12 @@ class LocalDB:
         print(len(self.color_rgb_values))
 
     def create_connection(self):
+        connections = getattr(_thread_state, 'connections', None)
+        if connections is not None:
+            conn = connections.get(self.DATABASE)
+            if conn is None:
+                conn = connections[self.DATABASE] = sqlite3.connect(self.DATABASE, factory=_ThreadConnection)
+            return conn
         conn = None
         try:
             conn = sqlite3.connect(self.DATABASE)
@@ -131,6 +244,39 @@ class LocalDB:
             print(e)
         return conn
 
+    def read_connection(self):
+        """Connection for queries: the read replica's if one is attached, else the catalog's."""
+        replica = self.read_replicas.get(self.DATABASE)
+        if replica is not None:
+            return replica.connection()
+        return self.create_connection()
+
+    def _write(self, write):
+        """Run write(cursor) in one transaction and return its result.
+
+        With a write-through replica attached, the same write is then repeated on
+        the replica, under its lock so both stores see the writes in one order.
+        """
+        replica = self.read_replicas.get(self.DATABASE)
+        if replica is None or not replica.write_through:
+            conn = self.create_connection()
+            with conn:
+                result = write(conn.cursor())
+            conn.close()
+            return result
+        with replica.lock:
+            conn = self.create_connection()
+            with conn:
+                result = write(conn.cursor())
+            conn.close()
+            replica.replay(write)
+        return result
+
+    def _refresh_replica(self):
+        replica = self.read_replicas.get(self.DATABASE)
+        if replica is not None:
+            replica.refresh()
+
     def initialize_db(self):
         conn = self.create_connection()
         if conn is not None:
@@ -147,13 +293,60 @@ class LocalDB:
                           tags TEXT,
                           file_location TEXT,
                           processed BOOLEAN NOT NULL DEFAULT 0)''')  # New column for processed status
+            c.execute("PRAGMA table_info(images)")
+            columns = {row[1] for row in c.fetchall()}
+            for column, declaration in self.EXTRA_COLUMNS.items():
+                if column not in columns:
+                    c.execute(f"ALTER TABLE images ADD COLUMN {column} {declaration}")
+            c.execute('''CREATE TABLE IF NOT EXISTS ocr_cache
+                         (fingerprint TEXT PRIMARY KEY,
+                          text TEXT NOT NULL)''')
+            c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_sources'")
+            has_tag_sources = c.fetchone() is not None
+            c.execute('''CREATE TABLE IF NOT EXISTS tag_sources
+                         (name TEXT NOT NULL,
+                          source TEXT NOT NULL,
+                          tags TEXT NOT NULL,
+                          version TEXT,
+                          PRIMARY KEY (name, source))''')
+            c.execute("PRAGMA table_info(tag_sources)")
+            if 'version' not in {row[1] for row in c.fetchall()}:
+                c.execute("ALTER TABLE tag_sources ADD COLUMN version TEXT")
+            if not has_tag_sources:
+                with conn:
+                    c.execute("INSERT INTO tag_sources (name, source, tags) SELECT name, ?, tags FROM images "
+                              "WHERE tags IS NOT NULL AND tags != ''", (LEGACY_SOURCE,))
+            c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_counts'")
+            has_tag_counts = c.fetchone() is not None
+            c.execute('''CREATE TABLE IF NOT EXISTS tag_counts
+                         (tag TEXT PRIMARY KEY,
+                          count INTEGER NOT NULL)''')
+            if not has_tag_counts:
+                self.rebuild_tag_counts(conn)
+            # Pair counts cost a write per pair of tags per image; facets use the TagIndex instead
+            c.execute("DROP TABLE IF EXISTS tag_pairs")
         except Error as e:
             print(e)
 
-    def get_main_colors(self, image_path, num_colors=3):
-        color_thief = ColorThief(image_path)
-        palette = color_thief.get_palette(color_count=num_colors)
-        return [self.rgb_to_color_name(rgb) for rgb in palette]
+    def get_main_colors(self, image, num_colors=3):
+        """Names of the main colors of a decoded PIL image or RGB array, or of an image file."""
+        if isinstance(image, Image.Image):
+            pixels = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+        elif isinstance(image, np.ndarray):
+            pixels = image
+        else:
+            # Decode a file at reduced scale; a palette needs a few thousand pixels, not megapixels
+            with Image.open(image) as source:
+                source.draft('RGB', (COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+                sample = source.convert('RGB')
+            sample.thumbnail((COLOR_SAMPLE_SIZE, COLOR_SAMPLE_SIZE))
+            pixels = np.asarray(sample)
+        return [self.rgb_to_color_name(rgb) for rgb in extract_palette(pixels, num_colors)]
+
+    def palette_version(self):
+        """Checksum of the RGB -> color name table; changes whenever a color would be named differently."""
+        table = repr([(tuple(rgb), self.rgb_to_color_name(rgb)) for rgb in self.color_rgb_values])
+        return format(zlib.crc32(table.encode()), '08x')
 
     def rgb_to_color_name(self, rgb):
         r, g, b = rgb
@@ -277,39 +470,323 @@ class LocalDB:
         closest_color_index = distances.index(min(distances))
         return colors[closest_color_index]
 
-    def save_tags(self, image_name, tags, file_location):
-        # Add color tags to the existing tags
-        color_tags = self.get_main_colors(file_location)  # Get colors from the image
-        tags.extend(color_tags)  # Combine existing tags with color tags
-        tags = list(set(tags))  # Remove duplicates from tags
+    @timed_db('write')
+    def save_tags(self, image_name, tags, file_location, with_colors=True):
+        """Make image_name's tags exactly tags (plus its main colors, unless with_colors is False).
 
+        Tags new to the image are recorded as the user's. For concurrent writers
+        prefer app.tag_writer.TagWriter, which batches mutations per source.
+        """
+        tags = list(tags)
+        mutations = []
+        if with_colors:
+            color_tags = self.get_main_colors(file_location)  # Get colors from the image
+            mutations.append(TagMutation(image_name, 'replace', 'colors', color_tags, file_location))
+            tags.extend(color_tags)  # Combine existing tags with color tags
+        mutations.append(TagMutation(image_name, 'set', USER_SOURCE, tags, file_location))
+        self.apply_tag_mutations(mutations)
+
+    @timed_db('write')
+    def apply_tag_mutations(self, mutations):
+        """Apply TagMutations in one transaction; returns {image name: image id}."""
+        if not mutations:
+            return {}
+        changes, ids = self._write(lambda c: self._apply_mutations(c, mutations))
+        self._tags_changed(changes)
+        return ids
+
+    def _apply_mutations(self, c, mutations):
+        by_name = OrderedDict()
+        for mutation in mutations:
+            by_name.setdefault(mutation.name, []).append(mutation)
+
+        changes, ids = [], {}
+        for image_name, image_mutations in by_name.items():
+            c.execute("SELECT source, tags, version FROM tag_sources WHERE name = ? ORDER BY rowid", (image_name,))
+            sources, versions = OrderedDict(), {}
+            for source, tags_str, version in c.fetchall():
+                sources[source] = split_tags(tags_str)
+                versions[source] = version
+            before = {source: (list(tags), versions[source]) for source, tags in sources.items()}
+            c.execute("SELECT tags, file_location FROM images WHERE name = ?", (image_name,))
+            row = c.fetchone()
+            old_tags = split_tags(row[0]) if row else []
+            file_location = row[1] if row else None
+            for mutation in image_mutations:
+                apply_mutation(sources, mutation, versions)
+                file_location = mutation.file_location or file_location
+
+            # A source row stays while it has tags, or a version recording that its analyzer ran
+            kept = {source: (tags, versions.get(source)) for source, tags in sources.items()
+                    if tags or versions.get(source) is not None}
+            c.executemany("DELETE FROM tag_sources WHERE name = ? AND source = ?",
+                          [(image_name, source) for source in before if source not in kept])
+            c.executemany("""
+                INSERT INTO tag_sources (name, source, tags, version) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name, source) DO UPDATE SET tags = excluded.tags, version = excluded.version
+            """, [(image_name, source, ', '.join(tags), version) for source, (tags, version) in kept.items()
+                  if before.get(source) != (tags, version)])
+            tags = union_tags(sources.values())
+            # UPDATE rather than INSERT OR REPLACE (or an upsert, which still uses up an
+            # AUTOINCREMENT value) so the row keeps a dense id; the embedding store is indexed by it
+            if row:
+                c.execute("UPDATE images SET tags = ?, file_location = ?, processed = ? WHERE name = ?",
+                          (', '.join(tags), file_location, True, image_name))
+            else:
+                c.execute("INSERT INTO images (name, tags, file_location, processed) VALUES (?, ?, ?, ?)",
+                          (image_name, ', '.join(tags), file_location, True))
+            self.update_tag_counts(c, old_tags, tags)
+            c.execute("SELECT id FROM images WHERE name = ?", (image_name,))
+            ids[image_name] = c.fetchone()[0]
+            changes.append((image_name, old_tags, tags, file_location))
+        return changes, ids
+
+    def _tags_changed(self, changes):
+        self.bump_write_generation()
+        for image_name, old_tags, tags, file_location in changes:
+            for listener in self.tag_listeners:
+                listener(self.DATABASE, image_name, old_tags, tags, file_location)
+
+    def update_tag_counts(self, cursor, old_tags, new_tags):
+        old_tags, new_tags = set(old_tags), set(new_tags)
+        cursor.executemany("""
+            INSERT INTO tag_counts (tag, count) VALUES (?, 1)
+            ON CONFLICT(tag) DO UPDATE SET count = count + 1
+        """, [(tag,) for tag in new_tags - old_tags])
+        removed = [(tag,) for tag in old_tags - new_tags]
+        cursor.executemany("UPDATE tag_counts SET count = count - 1 WHERE tag = ?", removed)
+        cursor.executemany("DELETE FROM tag_counts WHERE tag = ? AND count <= 0", removed)
+
+    def rebuild_tag_counts(self, conn):
+        counts = {}
+        for (tags_str,) in conn.execute("SELECT tags FROM images"):
+            for tag in set(split_tags(tags_str)):
+                counts[tag] = counts.get(tag, 0) + 1
+        with conn:
+            conn.execute("DELETE FROM tag_counts")
+            conn.executemany("INSERT INTO tag_counts (tag, count) VALUES (?, ?)", counts.items())
+
+    @timed_db('write')
+    def merge_from(self, database, conflicts=None):
+        """Fold another catalog (e.g. a CLI shard) into this one, unioning tags per source.
+
+        Images are keyed by file name, so an image whose name this catalog
+        already has for a different file_location is another file: it is not
+        merged, and (name, our location, their location) is appended to
+        conflicts. Returns (other id, merged id) pairs so callers can carry
+        id-keyed data across.
+        """
         conn = self.create_connection()
+        conn.execute("ATTACH DATABASE ? AS other", (database,))
+        id_map = []
         with conn:
             c = conn.cursor()
-            tags_str = ', '.join(tags)
+            c.execute("SELECT 1 FROM other.sqlite_master WHERE type = 'table' AND name = 'tag_sources'")
+            other_sources = {}
+            if c.fetchone() is not None:
+                c.execute("PRAGMA other.table_info(tag_sources)")
+                version_column = 'version' if 'version' in {row[1] for row in c.fetchall()} else 'NULL'
+                c.execute(f"SELECT name, source, tags, {version_column} FROM other.tag_sources ORDER BY rowid")
+                for image_name, source, tags_str, version in c.fetchall():
+                    other_sources.setdefault(image_name, []).append((source, split_tags(tags_str), version))
             c.execute("""
-                INSERT OR REPLACE INTO images (name, tags, file_location, processed)
-                VALUES (?, ?, ?, ?)
-            """, (image_name, tags_str, file_location, True))
+                SELECT theirs.name, ours.file_location, theirs.file_location
+                FROM other.images AS theirs JOIN main.images AS ours ON ours.name = theirs.name
+                WHERE ours.file_location IS NOT NULL AND theirs.file_location IS NOT NULL
+            """)
+            refused = set()
+            for image_name, location, other_location in c.fetchall():
+                if os.path.normpath(location) != os.path.normpath(other_location):
+                    refused.add(image_name)
+                    if conflicts is not None:
+                        conflicts.append((image_name, location, other_location))
+            c.execute("SELECT id, name, tags, file_location, phash FROM other.images")
+            rows = [row for row in c.fetchall() if row[1] not in refused]
+            mutations = []
+            for other_id, image_name, tags_str, file_location, phash in rows:
+                sources = other_sources.get(image_name) or [(LEGACY_SOURCE, split_tags(tags_str), None)]
+                # An empty add still brings over rows without any tags
+                mutations.append(TagMutation(image_name, 'add', USER_SOURCE, [], file_location))
+                # Versioned analyzer output is newer than ours; anything else is unioned
+                mutations.extend(TagMutation(image_name, 'replace' if version else 'add', source, tags,
+                                             file_location, version)
+                                 for source, tags, version in sources)
+            changes, ids = self._apply_mutations(c, mutations)
+            for other_id, image_name, tags_str, file_location, phash in rows:
+                if phash is not None:
+                    c.execute("UPDATE images SET phash = ? WHERE name = ?", (phash, image_name))
+                id_map.append((other_id, ids[image_name]))
+            c.execute("INSERT OR IGNORE INTO ocr_cache (fingerprint, text) SELECT fingerprint, text FROM other.ocr_cache")
+        conn.execute("DETACH DATABASE other")
+        conn.close()
+        self._refresh_replica()
+        self._tags_changed(changes)
+        return id_map
+
+    @timed_db('read')
+    def stale_images(self, versions):
+        """Images whose output from any of versions' sources is missing or has another version.
+
+        versions maps source (analyzer name) -> current version. Returns
+        [(name, file_location, [stale sources])].
+        """
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            stale = OrderedDict()
+            for source, version in versions.items():
+                c.execute("""
+                    SELECT images.name, images.file_location FROM images
+                    LEFT JOIN tag_sources ON tag_sources.name = images.name AND tag_sources.source = ?
+                    WHERE tag_sources.version IS NULL OR tag_sources.version != ?
+                    ORDER BY images.id
+                """, (source, version))
+                for image_name, file_location in c.fetchall():
+                    stale.setdefault((image_name, file_location), []).append(source)
+            return [(image_name, file_location, sources) for (image_name, file_location), sources in stale.items()]
+
+    def iter_catalog(self, batch_size=10000):
+        """Yield (name, file_location, tags) for every image in id order, a batch at a time."""
+        # Not @timed_db, which would only time creating the generator; this
+        # records the time spent in SQLite, without the caller's time between batches
+        elapsed = 0.0
+        conn = self.read_connection()
+        try:
+            start = time.perf_counter()
+            c = conn.cursor()
+            c.execute("SELECT name, file_location, tags FROM images ORDER BY id")
+            while True:
+                rows = c.fetchmany(batch_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                for name, file_location, tags_str in rows:
+                    yield name, file_location, split_tags(tags_str)
+                start = time.perf_counter()
+        finally:
+            conn.close()
+            DB_SECONDS.labels('read', 'iter_catalog').observe(elapsed)
+
+    @timed_db('read')
+    def get_tag_counts(self):
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            c.execute("SELECT tag, count FROM tag_counts")
+            return dict(c.fetchall())
 
+    @timed_db('read')
+    def get_tags_matching(self, tags):
+        """Tag lists of every image that search_images(tags) would return."""
+        query = normalize_search_tags(tags)
+        if not query:
+            return []
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            conditions = " OR ".join("tags LIKE ?" for _ in query)
+            c.execute(f"SELECT tags FROM images WHERE {conditions}", [f"%{tag}%" for tag in query])
+            return [split_tags(row[0]) for row in c.fetchall()]
+
+    @timed_db('read')
     def get_tags(self, image_name):
-        conn = self.create_connection()
+        conn = self.read_connection()
         with conn:
             c = conn.cursor()
             c.execute("SELECT tags FROM images WHERE name = ?", (image_name,))
             result = c.fetchone()
             return result[0].split(', ') if result else []
 
+    @timed_db('read')
+    def get_tag_sources(self, image_name):
+        """image_name's stored tags per source: OrderedDict of source -> (tags, version)."""
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            c.execute("SELECT source, tags, version FROM tag_sources WHERE name = ? ORDER BY rowid", (image_name,))
+            return OrderedDict((source, (split_tags(tags_str), version)) for source, tags_str, version in c.fetchall())
+
+    @timed_db('read')
+    def get_tags_many(self, image_names):
+        """Tags of many images in one round trip: {name: tags}, leaving out unknown names."""
+        image_names = list(dict.fromkeys(image_names))
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            found = {}
+            for start in range(0, len(image_names), SQL_BATCH_SIZE):
+                batch = image_names[start:start + SQL_BATCH_SIZE]
+                placeholders = ", ".join("?" for _ in batch)
+                c.execute(f"SELECT name, tags FROM images WHERE name IN ({placeholders})", batch)
+                found.update((name, split_tags(tags_str)) for name, tags_str in c.fetchall())
+            return {name: found[name] for name in image_names if name in found}
+
+    @timed_db('write')
+    def save_tags_many(self, updates, source=USER_SOURCE):
+        """Make each image's tags exactly the given ones, all in one transaction.
+
+        updates is an iterable of (image_name, tags, file_location); file_location
+        may be None for images already in the catalog. Returns {image name: image id}.
+        """
+        return self.apply_tag_mutations([TagMutation(image_name, 'set', source, tags, file_location)
+                                         for image_name, tags, file_location in updates])
+
+    @timed_db('read')
     def get_all_tags(self):
-        conn = self.create_connection()
+        conn = self.read_connection()
         with conn:
             c = conn.cursor()
             c.execute("SELECT name, tags FROM images")
             results = c.fetchall()
             return {name: tags.split(', ') for name, tags in results}
 
-    def search_images(self, tags):
-        conn = self.create_connection()  # Use your existing connection function
+    @property
+    def write_generation(self):
+        return self._write_generations.get(self.DATABASE, 0)
+
+    def bump_write_generation(self):
+        with self._cache_lock:
+            self._write_generations[self.DATABASE] = self.write_generation + 1
+
+    @timed_db('read')
+    def search_images(self, tags, fuzzy=False):
+        """Images with a tag containing any of tags, as (name, file_location).
+
+        With fuzzy=True and both a TrigramIndex and a TagIndex attached, each
+        tag also matches the catalog tags closest to it in spelling, so "siamse"
+        finds "Siamese cat". Those tags are looked up in the TagIndex postings;
+        without one, a fuzzy search is an ordinary one, as more LIKE terms
+        would only make every search scan longer.
+        """
+        query = normalize_search_tags(tags)
+        if not query:
+            return []
+        index = self.tag_indexes.get(self.DATABASE)
+        trigram_index = self.trigram_indexes.get(self.DATABASE) if fuzzy and index is not None else None
+        expanded = ()
+        if trigram_index is not None:
+            expanded = tuple(sorted({tag for term in query for tag in trigram_index.expand(term)}))
+        key = (self.DATABASE, query, expanded)
+        # Read the generation before querying: a write racing with the query
+        # leaves the entry already stale instead of caching old rows as new
+        generation = self.write_generation
+        with self._cache_lock:
+            cached = self._search_cache.get(key)
+        hit = cached is not None and cached[0] == generation
+        cache_result('search', hit)
+        if hit:
+            return list(cached[1])
+
+        if index is not None:
+            results = index.search_like(query, expanded)
+        else:
+            results = self._search_images_uncached(query)
+        with self._cache_lock:
+            self._search_cache.set(key, (generation, results))
+        return list(results)
+
+    def _search_images_uncached(self, tags):
+        conn = self.read_connection()  # Use your existing connection function
         cursor = conn.cursor()
         
         # Create a base query for fuzzy matching
@@ -330,40 +807,98 @@ class LocalDB:
         
         return [(row[0], row[1]) for row in results]  # Return name and file location
 
+    @timed_db('write')
     def reset_database(self):
         conn = self.create_connection()
         cursor = conn.cursor()
         cursor.execute("DROP TABLE IF EXISTS images")  # Drop the images table
+        cursor.execute("DROP TABLE IF EXISTS tag_counts")
+        cursor.execute("DROP TABLE IF EXISTS tag_sources")
         self.create_table(conn)  # Recreate the table
         conn.commit()
         conn.close()
+        self._refresh_replica()
+        self.bump_write_generation()
+        for callback in self.reset_callbacks:
+            callback()
 
+    @timed_db('read')
     def is_processed(self, image_name):
-        conn = self.create_connection()
+        conn = self.read_connection()
         with conn:
             c = conn.cursor()
             c.execute("SELECT processed FROM images WHERE name = ?", (image_name,))
             result = c.fetchone()
             return bool(result and result[0])
 
+    @timed_db('write')
     def set_processed(self, image_name, processed):
-        conn = self.create_connection()
-        with conn:
-            c = conn.cursor()
-            c.execute("UPDATE images SET processed = ? WHERE name = ?", (processed, image_name))
+        self._write(lambda c: c.execute("UPDATE images SET processed = ? WHERE name = ?", (processed, image_name)))
+        self.bump_write_generation()
 
+    @timed_db('read')
     def count_files(self):
-        conn = self.create_connection()
+        conn = self.read_connection()
         with conn:
             c = conn.cursor()
             c.execute("SELECT COUNT(*) FROM images")
             count = c.fetchone()[0]  # Get the count from the result
         return count
 
+    @timed_db('read')
     def get_file_location(self, image_name):
-        conn = self.create_connection()
+        conn = self.read_connection()
         with conn:
             c = conn.cursor()
             c.execute("SELECT file_location FROM images WHERE name = ?", (image_name,))
             result = c.fetchone()
-            return result[0] if result else None
\ No newline at end of file
+            return result[0] if result else None
+
+    @timed_db('read')
+    def get_ocr_text(self, fingerprint):
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            c.execute("SELECT text FROM ocr_cache WHERE fingerprint = ?", (fingerprint,))
+            result = c.fetchone()
+            return result[0] if result else None
+
+    @timed_db('write')
+    def save_ocr_text(self, fingerprint, text):
+        self._write(lambda c: c.execute("INSERT OR REPLACE INTO ocr_cache (fingerprint, text) VALUES (?, ?)",
+                                        (fingerprint, text)))
+
+    @timed_db('read')
+    def get_image_id(self, image_name):
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            c.execute("SELECT id FROM images WHERE name = ?", (image_name,))
+            result = c.fetchone()
+            return result[0] if result else None
+
+    @timed_db('read')
+    def get_images_by_ids(self, image_ids):
+        """Map image ids to (name, file_location), skipping ids that no longer exist."""
+        if not image_ids:
+            return {}
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            placeholders = ", ".join("?" for _ in image_ids)
+            c.execute(f"SELECT id, name, file_location FROM images WHERE id IN ({placeholders})", list(image_ids))
+            return {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+    @timed_db('write')
+    def set_phash(self, image_name, phash):
+        # SQLite integers are signed 64-bit
+        signed = phash - (1 << 64) if phash >= (1 << 63) else phash
+        self._write(lambda c: c.execute("UPDATE images SET phash = ? WHERE name = ?", (signed, image_name)))
+
+    @timed_db('read')
+    def get_phashes(self):
+        conn = self.read_connection()
+        with conn:
+            c = conn.cursor()
+            c.execute("SELECT name, phash FROM images WHERE phash IS NOT NULL")
+            return [(name, phash & 0xFFFFFFFFFFFFFFFF) for name, phash in c.fetchall()]
@@ -0,0 +1,156 @@
+"""Logging for the API, the GUI and the CLI that stays off the hot path.
+
+configure_logging() gives the root logger a single QueueHandler. Records are
+put on an in-memory queue, and a QueueListener thread formats them and
+writes them to the file and console. A logging call in the processing loop
+never waits for disk or terminal I/O.
+
+Below WARNING, each call site is rate limited with a token bucket, so a
+per-image message cannot flood the log at thousands of images per minute.
+When a site's messages were dropped, the next one it lets through says how
+many were dropped. Warnings and errors always pass.
+
+ProgressSummary replaces per-file lines in processing loops with one
+periodic line of progress and per-stage timings.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_RATE = 5.0  # Messages per second per call site, below WARNING
+DEFAULT_BURST = 20  # Messages a quiet call site may log at once
+DEFAULT_SUMMARY_INTERVAL = 10.0  # Seconds between progress summaries
+
+_lock = threading.Lock()
+_queue = queue.SimpleQueue()
+_queue_handler = None
+_listener = None
+_handlers = []
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site (file and line) for records below WARNING."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # (pathname, lineno) -> [tokens, last refill, dropped since last pass]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+def configure_logging(filename=None, level=None, console=False, console_level=None,
+                      rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+    """Send every log record through a queue to a background writer thread.
+
+    Like logging.basicConfig, the first call picks the log file, the level
+    (default: IMAGETAGGER_LOG_LEVEL, else INFO) and the rate limit. Later
+    calls, e.g. from a second module imported into the same process, can
+    only add the console or, with an explicit console_level, change its
+    level. The console defaults to WARNING.
+    """
+    global _queue_handler, _listener
+    with _lock:
+        handlers = list(_handlers)
+        if _queue_handler is None and filename:
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            handlers.append(logging.FileHandler(filename))
+        stream = next((handler for handler in handlers if type(handler) is logging.StreamHandler), None)
+        if console and stream is None:
+            stream = logging.StreamHandler()
+            stream.setLevel(logging.WARNING if console_level is None else console_level)
+            handlers.append(stream)
+        elif console and console_level is not None:
+            replacement = logging.StreamHandler()
+            replacement.setLevel(console_level)
+            if replacement.level != stream.level:
+                # A fresh handler rather than setLevel, so that records already
+                # queued are written out at the old level when the listener restarts
+                handlers[handlers.index(stream)] = replacement
+        if _queue_handler is not None and handlers == _handlers:
+            return
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        if _listener is not None:
+            _listener.stop()  # Writes out what is queued; records logged meanwhile wait in the queue
+        _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _handlers[:] = handlers
+
+        if _queue_handler is None:
+            _queue_handler = QueueHandler(_queue)
+            _queue_handler.addFilter(RateLimitFilter(rate, burst))
+            root = logging.getLogger()
+            root.addHandler(_queue_handler)
+            root.setLevel(level or os.environ.get('IMAGETAGGER_LOG_LEVEL', 'INFO').upper())
+            atexit.register(_stop)
+
+
+def _stop():
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+
+class ProgressSummary:
+    """One log line per interval with progress and per-stage timings.
+
+    The line's numbers are also attached to the record as record.progress,
+    for handlers that want them structured.
+    """
+
+    def __init__(self, logger, label, interval=DEFAULT_SUMMARY_INTERVAL):
+        self.logger = logger
+        self.label = label
+        self.interval = interval
+        self._last_time = time.monotonic()
+        self._last_processed = 0
+
+    def update(self, processed, total=None, snapshot=None, force=False):
+        """Log if interval has passed since the last line (or force); snapshot is StageStats.snapshot().
+
+        total may be None when the amount of work is not known up front.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if not force and elapsed < self.interval:
+            return
+        rate = (processed - self._last_processed) / elapsed if elapsed > 0 else 0.0
+        self._last_time, self._last_processed = now, processed
+        stages = {stage: round(1000 * stats['mean_seconds'], 1) for stage, stats in (snapshot or {}).items()}
+        progress = {'label': self.label, 'processed': processed, 'total': total,
+                    'images_per_s': round(rate, 1), 'mean_stage_ms': stages}
+        stage_text = ', '.join(f"{stage} {ms}ms" for stage, ms in stages.items())
+        count = processed if total is None else f"{processed}/{total}"
+        self.logger.info(f"{self.label}: {count} images, {rate:.1f} images/s"
+                         + (f"; mean per stage: {stage_text}" if stage_text else ""),
+                         extra={'progress': progress})
@@ -1,11 +1,10 @@
 from fastapi import FastAPI, BackgroundTasks
+from fastapi.responses import Response
 from pydantic import BaseModel
 import os
+import asyncio
 from PIL import Image
-import torch
-from torchvision import transforms
-from torchvision.models import resnet50, ResNet50_Weights
-from typing import List, Dict
+from typing import List, Dict, Optional
 import multiprocessing
 import json
 from functools import partial
@@ -16,15 +15,28 @@ from app.image_cache import *  # Import all image caching functions
 from app.text_extract import *  # Import all text extraction functions
 import logging
 
+from .logging_setup import configure_logging, ProgressSummary
 from .localDB import LocalDB
+from .preprocess import load_classifier_input
+from . import classifier
+from .pipeline import SUPPORTED_EXTENSIONS, default_pipeline, save_result
+from .embedding_store import EmbeddingStore
+from .phash import DuplicateIndex
+from . import metrics
+from .tag_index import TagVocabulary, TagIndex, TrigramIndex
+from .db_executor import DBExecutor
+from .tag_writer import TagWriter
+from .processing_queue import ProcessingQueue, PRIORITIES
+from .concurrency import GOVERNOR, STAGE_POOLS
+from .analyzer_workers import isolate
+from .read_replica import ReadReplica, DEFAULT_REFRESH_INTERVAL
 
 # Create an instance of LocalDB
 localDB = LocalDB()
 
 
-# Set up logging
-logging.basicConfig(filename='./logs/main_api.log', level=logging.DEBUG, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Set up logging; a background thread does the writing
+configure_logging('./logs/main_api.log')
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -36,8 +48,47 @@ class TagsUpdateRequest(BaseModel):
     filename: str
     tags: List[str]
 
+class TagsBatchRequest(BaseModel):
+    filenames: List[str]
+
+class TagsBatchUpdateRequest(BaseModel):
+    updates: List[TagsUpdateRequest]
+
 class SearchRequest(BaseModel):
     tags: List[str]
+    fuzzy: bool = False  # Also match tags with similar spelling
+
+class BooleanSearchRequest(BaseModel):
+    all_of: List[str] = []
+    any_of: List[str] = []
+    none_of: List[str] = []
+
+class BumpRequest(BaseModel):
+    filenames: List[str]
+    priority: str = "selected"  # "selected" or "visible"
+
+class FacetsRequest(BaseModel):
+    tags: List[str]
+    limit: int = 20
+
+class SimilarRequest(BaseModel):
+    filename: str
+    k: int = 10
+    nprobe: Optional[int] = None  # Clusters to scan; None scans everything
+
+class DuplicatesRequest(BaseModel):
+    filename: str
+    max_distance: int = 8
+
+class ClusterRequest(BaseModel):
+    n_clusters: int = 256
+
+class RetagRequest(BaseModel):
+    analyzers: Optional[List[str]] = None  # None checks every enabled analyzer
+
+class PipelineConfigRequest(BaseModel):
+    analyzers: Dict[str, bool] = {}
+    reuse_duplicates: Optional[bool] = None
 
 class ProcessingStatus(BaseModel):
     total: int
@@ -47,24 +98,68 @@ class ProcessingStatus(BaseModel):
 processing_status = ProcessingStatus(total=0, processed=0, current_file="")
 
 selected_folder = ""
+MAX_BATCH_SIZE = 10000  # Images per batch request
+
+# Files of the current run, bumped ahead when the GUI shows them
+processing_queue = ProcessingQueue()
 
-# Load pre-trained ResNet model
-logger.info("Loading pre-trained ResNet model")
-model = resnet50(weights=ResNet50_Weights.DEFAULT)
-model.eval()
+# Analyzers to run in worker processes, e.g. classifier,faces,colors, so the GUI and API keep the GIL
+ISOLATED_ANALYZERS = [name.strip() for name in os.environ.get('IMAGETAGGER_ISOLATE', '').split(',') if name.strip()]
 
-# Image preprocessing
-preprocess = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
+# Load pre-trained ResNet model and ImageNet class labels up front
+if 'classifier' not in ISOLATED_ANALYZERS:
+    classifier.get_model()
+classifier.get_categories()
 
-# Load ImageNet class labels
-logger.info("Loading ImageNet class labels")
-with open("./app/imagenet_classes.txt", "r") as f:
-    categories = [s.strip() for s in f.readlines()]
+# Decode-once analysis pipeline: classifier, colors, faces and OCR
+pipeline = default_pipeline(localDB)
+analyzer_pools = isolate(pipeline, localDB, ISOLATED_ANALYZERS,
+                         processes=int(os.environ.get('IMAGETAGGER_ANALYZER_PROCESSES', 1)),
+                         threads={name: GOVERNOR.threads(STAGE_POOLS.get(name, 'opencv')) for name in ISOLATED_ANALYZERS})
+
+# Blocking LocalDB calls from async endpoints run here, off the event loop
+db = DBExecutor(GOVERNOR.threads('db'))
+
+# torch, OpenCV and the OCR processes share one CPU budget instead of each taking every core
+GOVERNOR.register('ocr', pipeline.analyzers['ocr'].set_workers)
+GOVERNOR.apply()
+AUTOTUNE_EVERY = 50  # Images between thread budget rebalances
+
+# Optional in-memory copy of the catalog that answers every read; 'write-through' or 'refresh'
+if os.environ.get('IMAGETAGGER_READ_REPLICA'):
+    ReadReplica.attach(localDB, os.environ['IMAGETAGGER_READ_REPLICA'],
+                       float(os.environ.get('IMAGETAGGER_REPLICA_REFRESH', DEFAULT_REFRESH_INTERVAL)))
+
+# Single writer that batches every tag mutation into group commits
+tag_writer = TagWriter.get(localDB)
+
+# Tag names and per-tag image counts for autocomplete and facets
+tag_vocabulary = TagVocabulary(localDB)
+
+# Trigrams of the tag vocabulary for typo-tolerant searches; memory grows with the vocabulary, not the catalog
+trigram_index = TrigramIndex.attach(localDB)
+
+# Optional in-memory tag index; once attached, /search and GUI searches skip SQLite
+if os.environ.get('IMAGETAGGER_TAG_INDEX') == '1':
+    logger.info("Building in-memory tag index")
+    tag_index = TagIndex.attach(localDB)
+    logger.info(f"Tag index ready: {len(tag_index.names)} images, {tag_index.memory_bytes()} bytes of postings")
+
+# Classifier embeddings, one float16 row per catalog id
+embedding_store = EmbeddingStore()
+LocalDB.reset_callbacks.append(embedding_store.clear)
+
+# Perceptual hashes of processed images for near-duplicate lookups
+duplicate_index = DuplicateIndex.from_rows(localDB.get_phashes())
+LocalDB.reset_callbacks.append(duplicate_index.clear)
+REUSE_MAX_DISTANCE = 4  # Hamming distance under which a duplicate's tags are reused
+
+def reuse_duplicate_tags(decoded):
+    for distance, name in duplicate_index.find(decoded.outputs['phash'], REUSE_MAX_DISTANCE):
+        if name != decoded.name:
+            logger.debug(f"Reusing tags of {name} for {decoded.name} (distance {distance})")
+            return name, localDB.get_tag_sources(name)
+    return None
 
 @app.get("/")
 async def root():
@@ -86,53 +181,155 @@ async def process_images(background_tasks: BackgroundTasks):
         return {"error": "No folder selected"}
 
     global processing_status
-    image_files = [f for f in os.listdir(selected_folder) if is_supported_image(f)]
+    image_files = sorted(f for f in os.listdir(selected_folder) if is_supported_image(f))
     processing_status = ProcessingStatus(total=len(image_files), processed=0, current_file="")
+    processing_queue.clear()
+    for filename in image_files:
+        processing_queue.put(os.path.join(selected_folder, filename))
     
     logger.info(f"Starting background task to process {len(image_files)} images")
     background_tasks.add_task(process_images_task, background_tasks)
     
     return {"message": "Processing started"}
 
+@app.post("/bump")
+async def bump(bump_request: BumpRequest):
+    priority = PRIORITIES.get(bump_request.priority)
+    if priority is None:
+        logger.warning(f"Unknown bump priority: {bump_request.priority}")
+        return {"error": f"Unknown priority: {bump_request.priority}"}
+    paths = [os.path.join(selected_folder, filename) for filename in bump_request.filenames]
+    bumped = processing_queue.bump(paths, priority)
+    logger.debug(f"Bumped {bumped} of {len(paths)} images to {bump_request.priority}")
+    return {"bumped": bumped, "queued": len(processing_queue)}
+
 @app.get("/get_tags")
 async def get_tags():
     logger.info("Retrieving all tags")
-    return localDB.get_all_tags()
+    return await db.run(localDB.get_all_tags)
 
 async def process_images_task(background_tasks):
     logger.info("Starting image processing task")
-    for filename in os.listdir(selected_folder):
-        if is_supported_image(filename):
-            file_path = os.path.join(selected_folder, filename)
-            logger.debug(f"Processing image: {file_path}")
-            try:
-                tags = await process_image(file_path)
-                localDB.save_tags(filename, tags, file_path)
-                logger.info(f"Tags saved to database for {filename}: {tags}")
-            except Exception as e:
-                logger.error(f"Error processing {filename}: {str(e)}")
-            # Update processing status
-            processing_status.processed += 1
-            processing_status.current_file = filename
-            logger.debug(f"Processed {processing_status.processed} out of {processing_status.total} images")
+    summary = ProgressSummary(logger, "Processing")
+    while True:
+        # Popped one at a time so bumps made meanwhile take effect immediately
+        file_path = processing_queue.pop()
+        if file_path is None:
+            break
+        filename = os.path.basename(file_path)
+        logger.debug(f"Processing image: {file_path}")
+        metrics.QUEUE_DEPTH.labels('processing').set(len(processing_queue) + 1)
+        try:
+            result = await process_image(file_path)
+            tags = save_result(localDB, result, embedding_store, duplicate_index, wait=False)
+            logger.debug(f"Tags saved to database for {filename}: {tags}")
+            metrics.IMAGES_PROCESSED.labels('reused' if result.reused_from else 'tagged').inc()
+        except Exception as e:
+            logger.error(f"Error processing {filename}: {str(e)}")
+            metrics.IMAGES_PROCESSED.labels('error').inc()
+        # Update processing status
+        processing_status.processed += 1
+        if processing_status.processed % AUTOTUNE_EVERY == 0:
+            GOVERNOR.autotune(pipeline.stats.snapshot())
+        processing_status.current_file = filename
+        summary.update(processing_status.processed, processing_status.total, pipeline.stats.snapshot())
+    summary.update(processing_status.processed, processing_status.total, pipeline.stats.snapshot(), force=True)
+    await db.run(tag_writer.flush)
+    embedding_store.flush()
+    metrics.QUEUE_DEPTH.labels('processing').set(0)
     logger.info("Image processing task completed")
 
 async def process_image(file_path):
     logger.debug(f"Processing individual image: {file_path}")
-    filename = os.path.basename(file_path)
-    tags = generate_tags(file_path)
-    
-    # Save tags to the database instead of the image
-    localDB.save_tags(filename, tags, file_path)
-    logger.info(f"Tags saved to database for {filename}: {tags}")
-    
-    return tags
+    # Decoding and inference release the GIL; a worker thread keeps the API responsive meanwhile
+    result = await asyncio.get_running_loop().run_in_executor(None, pipeline.process, file_path)
+    logger.debug(f"Stage timings for {file_path}: {dict(result.timings)}")
+    return result
 
 @app.get("/processing_status")
 async def get_processing_status():
     logger.debug(f"Current processing status: {processing_status}")
     return processing_status
 
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/pipeline")
+async def get_pipeline():
+    return {
+        "analyzers": pipeline.describe(),
+        "reuse_duplicates": pipeline.reuse is not None,
+        "timings": pipeline.stats.snapshot(),
+    }
+
+@app.post("/pipeline")
+async def configure_pipeline(config: PipelineConfigRequest):
+    for name in config.analyzers:
+        if name not in pipeline.analyzers:
+            logger.warning(f"Unknown analyzer requested: {name}")
+            return {"error": f"Unknown analyzer: {name}"}
+    for name, enabled in config.analyzers.items():
+        pipeline.set_enabled(name, enabled)
+    if config.reuse_duplicates is not None:
+        pipeline.reuse = reuse_duplicate_tags if config.reuse_duplicates else None
+    logger.info(f"Pipeline analyzers set to: {pipeline.describe()}, reuse duplicates: {pipeline.reuse is not None}")
+    return {"analyzers": pipeline.describe(), "reuse_duplicates": pipeline.reuse is not None}
+
+def retag_versions(analyzers):
+    """Current version of each requested analyzer, or an error message."""
+    names = analyzers if analyzers is not None else [a.name for a in pipeline.enabled_analyzers()]
+    for name in names:
+        if name not in pipeline.analyzers:
+            return None, f"Unknown analyzer: {name}"
+    return pipeline.versions(names), None
+
+@app.get("/retag/stale")
+async def stale_images(analyzers: Optional[str] = None):
+    versions, error = retag_versions(analyzers.split(',') if analyzers else None)
+    if error:
+        return {"error": error}
+    stale = await db.run(localDB.stale_images, versions)
+    counts = dict.fromkeys(versions, 0)
+    for _, _, sources in stale:
+        for source in sources:
+            counts[source] += 1
+    return {"versions": versions, "images": len(stale), "stale": counts}
+
+@app.post("/retag")
+async def retag(retag_request: RetagRequest, background_tasks: BackgroundTasks):
+    """Re-run only the analyzers whose stored outputs came from another version."""
+    versions, error = retag_versions(retag_request.analyzers)
+    if error:
+        logger.warning(f"Retag requested with {error}")
+        return {"error": error}
+    stale = await db.run(localDB.stale_images, versions)
+
+    global processing_status
+    processing_status = ProcessingStatus(total=len(stale), processed=0, current_file="")
+    logger.info(f"Starting background task to retag {len(stale)} images against {versions}")
+    background_tasks.add_task(retag_task, stale)
+    return {"message": "Retagging started", "images": len(stale)}
+
+async def retag_task(stale):
+    loop = asyncio.get_running_loop()
+    summary = ProgressSummary(logger, "Retagging")
+    for image_name, file_location, sources in stale:
+        processing_status.current_file = image_name
+        try:
+            result = await loop.run_in_executor(None, partial(pipeline.process, file_location, only=sources))
+            save_result(localDB, result, embedding_store, duplicate_index, wait=False)
+            logger.debug(f"Retagged {image_name} with {sources}")
+            metrics.IMAGES_PROCESSED.labels('retagged').inc()
+        except Exception as e:
+            logger.error(f"Error retagging {image_name}: {str(e)}")
+            metrics.IMAGES_PROCESSED.labels('error').inc()
+        processing_status.processed += 1
+        summary.update(processing_status.processed, processing_status.total, pipeline.stats.snapshot())
+    await db.run(tag_writer.flush)
+    embedding_store.flush()
+    logger.info(f"Retag task completed: {processing_status.processed} images")
+
 @app.post("/update_tags")
 async def update_tags(data: dict):
     logger.info(f"Updating tags for: {data.get('filename')}")
@@ -141,37 +338,119 @@ async def update_tags(data: dict):
     if not filename or tags is None:
         logger.warning("Invalid data for tag update")
         return {"error": "Invalid data"}
-    
-    # Update the database
-    localDB.save_tags(filename, tags)
+
+    file_location = await db.run(localDB.get_file_location, filename)
+    if file_location is None:
+        logger.warning(f"Tag update for unknown image: {filename}")
+        return {"error": "Unknown image"}
+    # Update the database; tags the user removed are dropped from every source
+    await asyncio.wrap_future(tag_writer.set_tags(filename, tags, file_location))
     
     logger.info(f"Tags updated successfully for: {filename}")
     return {"message": "Tags updated successfully"}
 
+@app.post("/get_tags/batch")
+async def get_tags_batch(batch_request: TagsBatchRequest):
+    if len(batch_request.filenames) > MAX_BATCH_SIZE:
+        return {"error": f"At most {MAX_BATCH_SIZE} filenames per request"}
+    tags = await db.run(localDB.get_tags_many, batch_request.filenames)
+    return {"tags": tags, "missing": [name for name in batch_request.filenames if name not in tags]}
+
+@app.post("/update_tags/batch")
+async def update_tags_batch(batch_request: TagsBatchUpdateRequest):
+    """Apply many tag edits in one transaction. Unknown images are skipped and listed."""
+    if len(batch_request.updates) > MAX_BATCH_SIZE:
+        return {"error": f"At most {MAX_BATCH_SIZE} updates per request"}
+    known = await db.run(localDB.get_tags_many, [update.filename for update in batch_request.updates])
+    updates = [(update.filename, update.tags, None) for update in batch_request.updates if update.filename in known]
+    missing = [update.filename for update in batch_request.updates if update.filename not in known]
+    if updates:
+        await asyncio.wrap_future(tag_writer.set_tags_many(updates))
+    logger.info(f"Batch tag update: {len(updates)} updated, {len(missing)} unknown")
+    return {"updated": len(updates), "missing": missing}
+
 @app.post("/search")
 async def search_images(search_request: SearchRequest):
     logger.info(f"Searching images with tags: {search_request.tags}")
-    return localDB.search_images(search_request.tags)
+    if search_request.fuzzy and localDB.DATABASE not in LocalDB.tag_indexes:
+        logger.warning("Fuzzy search requested without a tag index")
+        return {"error": "Fuzzy search needs the tag index (set IMAGETAGGER_TAG_INDEX=1)"}
+    return await db.run(localDB.search_images, search_request.tags, search_request.fuzzy)
+
+@app.post("/search/boolean")
+async def boolean_search(search_request: BooleanSearchRequest):
+    logger.info(f"Boolean search: {search_request}")
+    tag_index = LocalDB.tag_indexes.get(localDB.DATABASE)
+    if tag_index is None:
+        logger.warning("Boolean search requested without a tag index")
+        return {"error": "Tag index is not enabled (set IMAGETAGGER_TAG_INDEX=1)"}
+    return tag_index.search(search_request.all_of, search_request.any_of, search_request.none_of)
+
+@app.get("/search/expand")
+async def expand_search_term(term: str, limit: int = 10):
+    """Catalog terms spelled like term, with their trigram similarity."""
+    return [{"term": match, "similarity": round(similarity, 3)}
+            for match, similarity in trigram_index.similar(term, limit)]
+
+@app.get("/autocomplete")
+async def autocomplete(prefix: str, limit: int = 10):
+    suggestions = tag_vocabulary.autocomplete(prefix, limit)
+    return [{"tag": tag, "count": count} for tag, count in suggestions]
+
+@app.post("/facets")
+async def facets(facets_request: FacetsRequest):
+    logger.info(f"Facets for tags: {facets_request.tags}")
+    total, counts = await db.run(tag_vocabulary.facets, facets_request.tags, facets_request.limit)
+    return {"total": total, "facets": [{"tag": tag, "count": count} for tag, count in counts]}
+
+@app.post("/similar")
+async def similar_images(similar_request: SimilarRequest):
+    logger.info(f"Finding images similar to: {similar_request.filename}")
+    image_id = await db.run(localDB.get_image_id, similar_request.filename)
+    query = embedding_store.get(image_id) if image_id is not None else None
+    if query is None:
+        logger.warning(f"No embedding for {similar_request.filename}")
+        return {"error": "Image has not been processed"}
+
+    matches = embedding_store.search(query, k=similar_request.k, exclude=image_id,
+                                     nprobe=similar_request.nprobe)
+    images = await db.run(localDB.get_images_by_ids, [match_id for match_id, _ in matches])
+    return [
+        {"name": images[match_id][0], "file_location": images[match_id][1], "score": score}
+        for match_id, score in matches if match_id in images
+    ]
+
+@app.post("/similar/clusters")
+async def build_similarity_clusters(cluster_request: ClusterRequest):
+    logger.info(f"Building {cluster_request.n_clusters} embedding clusters")
+    n_clusters = embedding_store.build_clusters(cluster_request.n_clusters)
+    return {"clusters": n_clusters}
+
+@app.post("/duplicates")
+async def find_duplicates(duplicates_request: DuplicatesRequest):
+    logger.info(f"Finding near-duplicates of: {duplicates_request.filename}")
+    matches = duplicate_index.near_duplicates(duplicates_request.filename, duplicates_request.max_distance)
+    return [{"name": name, "distance": distance} for distance, name in matches]
+
+@app.get("/duplicate_clusters")
+async def duplicate_clusters(max_distance: int = 4):
+    logger.info(f"Building duplicate cluster report, max distance {max_distance}")
+    clusters = duplicate_index.clusters(max_distance)
+    return {"clusters": clusters, "duplicates": sum(len(cluster) - 1 for cluster in clusters)}
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    db.shutdown()
+    for pool in analyzer_pools:
+        pool.close()
 
 def is_supported_image(filename):
-    return filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
 
 def generate_tags(image_path):
     logger.debug(f"Generating tags for: {image_path}")
     try:
-        image = Image.open(image_path)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        input_tensor = preprocess(image)
-        input_batch = input_tensor.unsqueeze(0)
-
-        with torch.no_grad():
-            output = model(input_batch)
-
-        probabilities = torch.nn.functional.softmax(output[0], dim=0)
-        top5_prob, top5_catid = torch.topk(probabilities, 5)
-        
-        tags = [categories[idx] for idx in top5_catid]
+        tags = classifier.classify(load_classifier_input(image_path))
         logger.debug(f"Generated tags for {image_path}: {tags}")
         return tags
     except Exception as e:
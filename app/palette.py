@@ -0,0 +1,88 @@
+"""Dominant colors of a decoded image, vectorized with NumPy.
+
+ColorThief's MMCQ runs in pure Python over every sampled pixel. Here the
+pixels are binned once, at 5 bits per channel as MMCQ does, with a single
+np.bincount. The box splitting then runs on the occupied bins (at most
+32768, usually a few thousand) instead of on the pixels. As in MMCQ, boxes
+of similar colors are split along one channel until there are enough of
+them. Each step splits the box with the largest pixel-weighted squared
+error, at the cut that minimizes the two halves' error. A median cut would
+split the largest cluster in half instead of separating two clusters.
+"""
+import numpy as np
+
+SIGBITS = 5  # Bits kept per channel, as in MMCQ
+RSHIFT = 8 - SIGBITS
+WHITE_THRESHOLD = 250  # ColorThief skips pixels brighter than this in every channel
+
+
+def color_histogram(pixels, skip_white=True):
+    """Occupied bins of an HxWx3 uint8 array: ((n, 3) bin coordinates, (n,) pixel counts)."""
+    pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    if skip_white:
+        kept = pixels[~np.all(pixels > WHITE_THRESHOLD, axis=1)]
+        if len(kept):
+            pixels = kept  # An all-white image still gets a palette
+    quantized = (pixels >> RSHIFT).astype(np.int32)
+    index = (quantized[:, 0] << (2 * SIGBITS)) | (quantized[:, 1] << SIGBITS) | quantized[:, 2]
+    counts = np.bincount(index, minlength=1 << (3 * SIGBITS))
+    bins = np.flatnonzero(counts)
+    mask = (1 << SIGBITS) - 1
+    coordinates = np.stack([bins >> (2 * SIGBITS), (bins >> SIGBITS) & mask, bins & mask], axis=1)
+    return coordinates, counts[bins]
+
+
+def _spread(coordinates, counts):
+    """Pixel-weighted sum of squared distances from the mean, per channel."""
+    weights = counts[:, None].astype(np.float64)
+    total = weights.sum()
+    mean = (coordinates * weights).sum(axis=0) / total
+    return (weights * (coordinates - mean) ** 2).sum(axis=0)
+
+
+def _split(coordinates, counts, box):
+    """Split box (indices into coordinates) along its widest channel where the
+    two halves' squared error is smallest, never between bins of equal value."""
+    box_coordinates = coordinates[box]
+    axis = int(np.argmax(_spread(box_coordinates, counts[box])))
+    order = np.argsort(box_coordinates[:, axis], kind='stable')
+    box = box[order]
+    values = box_coordinates[order, axis].astype(np.float64)
+    weights = counts[box].astype(np.float64)
+    # Squared error of every prefix and suffix from running sums
+    w, s, q = np.cumsum(weights), np.cumsum(weights * values), np.cumsum(weights * values ** 2)
+    left = q[:-1] - s[:-1] ** 2 / w[:-1]
+    right = (q[-1] - q[:-1]) - (s[-1] - s[:-1]) ** 2 / (w[-1] - w[:-1])
+    error = left + right
+    error[values[1:] == values[:-1]] = np.inf
+    cut = int(np.argmin(error)) + 1
+    return box[:cut], box[cut:]
+
+
+def extract_palette(pixels, color_count=3, skip_white=True):
+    """Up to color_count (r, g, b) tuples for an HxWx3 uint8 array, most common first."""
+    coordinates, counts = color_histogram(pixels, skip_white)
+    if not len(counts):
+        return []
+    boxes = [np.arange(len(counts))]
+    while len(boxes) < color_count:
+        # Split the box whose pixels are furthest from its mean color
+        best, best_score = None, 0.0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            score = _spread(coordinates[box], counts[box]).sum()
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break  # Every box is a single color
+        boxes.extend(_split(coordinates, counts, boxes.pop(best)))
+
+    palette = []
+    for box in boxes:
+        weights = counts[box]
+        mean = (coordinates[box] * weights[:, None]).sum(axis=0) / weights.sum()
+        rgb = tuple(int(min(255, value)) for value in mean * (1 << RSHIFT) + (1 << RSHIFT) / 2)
+        palette.append((int(weights.sum()), rgb))
+    palette.sort(key=lambda entry: entry[0], reverse=True)
+    return [rgb for _, rgb in palette]
@@ -0,0 +1,123 @@
+import threading
+import numpy as np
+from PIL import Image
+
+HASH_SOURCE_SIZE = 64  # Shorter side of the variant the hash is computed from
+
+
+def dhash(image):
+    """64-bit difference hash of a PIL image: brighter-than-right-neighbour bits on a 9x8 grid."""
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes using Hamming distance.
+
+    Nodes are [hash, items, children] lists, children keyed by distance.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return (distance, hash, item) for every item within max_distance."""
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, node[0], item) for item in node[1])
+            # Triangle inequality: only subtrees in [d - r, d + r] can match
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+class DuplicateIndex:
+    """Perceptual hashes of processed images, searchable by Hamming distance."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tree = BKTree()
+        self.hashes = {}  # image name -> current hash
+
+    @classmethod
+    def from_rows(cls, rows):
+        index = cls()
+        for name, value in rows:
+            index.add(name, value)
+        return index
+
+    def add(self, name, value):
+        with self._lock:
+            if self.hashes.get(name) == value:
+                return
+            # BK-trees cannot delete; a re-hashed image leaves a stale entry
+            # behind that find() filters out against self.hashes
+            self.hashes[name] = value
+            self.tree.add(value, name)
+
+    def clear(self):
+        with self._lock:
+            self.tree = BKTree()
+            self.hashes = {}
+
+    def find(self, value, max_distance):
+        """Return [(distance, name)] within max_distance, nearest first."""
+        with self._lock:
+            matches = [(distance, name) for distance, node_value, name in self.tree.search(value, max_distance)
+                       if self.hashes.get(name) == node_value]
+        return sorted(matches)
+
+    def near_duplicates(self, name, max_distance):
+        value = self.hashes.get(name)
+        if value is None:
+            return []
+        return [(distance, other) for distance, other in self.find(value, max_distance) if other != name]
+
+    def clusters(self, max_distance):
+        """Group every image with its near-duplicates. Returns clusters of two or more names."""
+        with self._lock:
+            hashes = dict(self.hashes)
+        parent = {name: name for name in hashes}
+
+        def root(name):
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for name, value in hashes.items():
+            for distance, other in self.find(value, max_distance):
+                a, b = root(name), root(other)
+                if a != b:
+                    parent[b] = a
+
+        groups = {}
+        for name in hashes:
+            groups.setdefault(root(name), []).append(name)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=len, reverse=True)
@@ -0,0 +1,507 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+import numpy as np
+from PIL import Image
+
+from . import classifier
+from .preprocess import RESIZE_SIZE, preprocess_image
+from .phash import HASH_SOURCE_SIZE, dhash
+from .metrics import STAGE_SECONDS, STAGE_ERRORS, INFLIGHT_PIXELS
+from .tag_writer import TagWriter
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+REUSED_SOURCE = 'reused'  # Unversioned tags copied from a near-duplicate
+
+# Memory bounds. JPEG decodes at reduced scale to stay near MAX_DECODE_PIXELS.
+# PNG, BMP and GIF cannot: they decode at full size and are then downsampled,
+# so files of those formats above MAX_FULL_DECODE_PIXELS are refused outright.
+# A PixelBudget only admits another image while the pixels already in flight
+# leave room for it, and refuses any image bigger than the whole budget.
+MAX_DECODE_PIXELS = 40_000_000
+MAX_FULL_DECODE_PIXELS = 100_000_000
+MAX_INFLIGHT_PIXELS = 160_000_000
+
+
+class ImageTooLarge(ValueError):
+    """The image would decode to more pixels than the memory bounds allow."""
+
+
+def open_reduced(path, min_side=None, max_pixels=MAX_DECODE_PIXELS, max_full_pixels=MAX_FULL_DECODE_PIXELS):
+    """Open path without decoding and pick the smallest decode scale that still
+    leaves min_side pixels on the shorter side, and at most about max_pixels.
+
+    Only JPEG can decode at reduced scale (1/2, 1/4 or 1/8), and a JPEG that
+    would be over max_full_pixels at the chosen scale is reduced further,
+    down to 1/8, even below min_side. Other formats keep their full size here.
+    Either way image.size is what load() will produce. Raises ImageTooLarge
+    if that is over max_full_pixels.
+    """
+    image = Image.open(path)
+    width, height = image.size
+    scale = 1.0
+    if min_side is not None:
+        scale = min(scale, max(1, min_side) / min(width, height))
+    if max_pixels and width * height * scale * scale > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+    request = None
+    if scale < 1.0:
+        request = (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale)))
+    if image.format == 'JPEG' and max_full_pixels:
+        # draft() never goes below the requested size, so a request just under
+        # the full size still decodes at 1/1. Ask for the largest power-of-two
+        # reduction that fits max_full_pixels whenever the request is bigger.
+        for reduction in (1, 2, 4, 8):
+            if math.ceil(width / reduction) * math.ceil(height / reduction) <= max_full_pixels:
+                break
+        fitting = (max(1, width // reduction), max(1, height // reduction))
+        if reduction > 1 and (request is None or request[0] > fitting[0] or request[1] > fitting[1]):
+            request = fitting
+    if request is not None:
+        image.draft('RGB', request)
+    if max_full_pixels and image.width * image.height > max_full_pixels:
+        image.close()
+        raise ImageTooLarge(f"{path} decodes to {image.width}x{image.height}, "
+                            f"over the {max_full_pixels} pixel limit for {image.format or 'this format'}")
+    return image
+
+
+class PixelBudget:
+    """Admission control on the decoded pixels of the images processed at once.
+
+    admit() blocks while taking another image would push the pixels in flight
+    over max_pixels. An image bigger than the whole budget raises ImageTooLarge.
+    """
+
+    def __init__(self, max_pixels=MAX_INFLIGHT_PIXELS):
+        self.max_pixels = max_pixels
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, pixels):
+        if pixels > self.max_pixels:
+            raise ImageTooLarge(f"{pixels} decoded pixels exceed the {self.max_pixels} pixel budget")
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight + pixels <= self.max_pixels)
+            self.in_flight += pixels
+            INFLIGHT_PIXELS.set(self.in_flight)
+
+    def release(self, pixels):
+        with self._condition:
+            self.in_flight -= pixels
+            INFLIGHT_PIXELS.set(self.in_flight)
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, pixels):
+        self.acquire(pixels)
+        try:
+            yield
+        finally:
+            self.release(pixels)
+
+
+class DecodedImage:
+    """An image file decoded once and shared by every analyzer of a pipeline run."""
+
+    def __init__(self, path, image):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.image = image
+        self._variants = {}
+        self._gray = {}
+        self.outputs = {}  # Non-tag analyzer outputs, e.g. the classifier embedding
+        self.shared_frames = {}  # min_side -> SharedFrame handed to analyzer worker processes
+
+    @classmethod
+    def open(cls, path, min_side=None, max_pixels=MAX_DECODE_PIXELS):
+        return cls.decode(path, open_reduced(path, min_side, max_pixels), max_pixels)
+
+    @classmethod
+    def decode(cls, path, image, max_pixels=MAX_DECODE_PIXELS):
+        """Decode an image returned by open_reduced."""
+        image.load()  # Reads the pixels and releases the file handle
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = image.size
+        if max_pixels and width * height > max_pixels:
+            # Formats without reduced decoding are brought within budget right away
+            scale = math.sqrt(max_pixels / (width * height))
+            image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                 Image.BILINEAR, reducing_gap=3.0)
+        return cls(path, image)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def variant(self, min_side):
+        """Downscaled copy whose shorter side is min_side. Never upscales."""
+        width, height = self.image.size
+        if min(width, height) <= min_side:
+            return self.image
+        if min_side not in self._variants:
+            scale = min_side / min(width, height)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            # Resample from the smallest variant that is still big enough
+            larger = [side for side in self._variants if side > min_side]
+            source = self._variants[min(larger)] if larger else self.image
+            self._variants[min_side] = source.resize(size, Image.BILINEAR, reducing_gap=3.0)
+        return self._variants[min_side]
+
+    def pixels(self, min_side=None):
+        """HxWx3 uint8 view of the full image or of a downscaled variant."""
+        image = self.image if min_side is None else self.variant(min_side)
+        return np.asarray(image)
+
+    def gray(self, min_side=None):
+        """HxW uint8 grayscale of the full image or of a downscaled variant."""
+        if min_side not in self._gray:
+            image = self.image if min_side is None else self.variant(min_side)
+            self._gray[min_side] = np.asarray(image.convert('L'))
+        return self._gray[min_side]
+
+
+class Analyzer:
+    """A pipeline stage. analyze() receives a DecodedImage and returns a list of tags.
+
+    Asynchronous analyzers return a Future instead. They are started before
+    the others, and collect() turns the Future's result into tags.
+    """
+    name = None
+    version = '1'  # Stamped on the stored tags; bump it when the output would change
+    enabled = True
+    asynchronous = False
+    input_side = None  # Shorter side the analyzer needs; None means full resolution
+
+    def analyze(self, decoded):
+        raise NotImplementedError
+
+    def collect(self, value):
+        return value
+
+
+class HashAnalyzer(Analyzer):
+    """Computes the perceptual hash used for near-duplicate detection. Adds no tags."""
+    name = 'phash'
+    input_side = HASH_SOURCE_SIZE
+
+    def analyze(self, decoded):
+        decoded.outputs['phash'] = dhash(decoded.variant(HASH_SOURCE_SIZE))
+        return []
+
+
+class ClassifierAnalyzer(Analyzer):
+    name = 'classifier'
+    input_side = RESIZE_SIZE
+    version = classifier.MODEL_VERSION
+
+    def analyze(self, decoded):
+        tags, embedding = classifier.classify_and_embed(preprocess_image(decoded.variant(RESIZE_SIZE)))
+        decoded.outputs['embedding'] = embedding
+        return tags
+
+
+class ColorAnalyzer(Analyzer):
+    name = 'colors'
+    SAMPLE_SIZE = 200  # A palette does not need more pixels than this
+    input_side = SAMPLE_SIZE
+
+    def __init__(self, localDB):
+        self.localDB = localDB
+
+    @property
+    def version(self):
+        # Changing the palette table changes the color names every image gets
+        return f"histogram/{self.localDB.palette_version()}"
+
+    def analyze(self, decoded):
+        return self.localDB.get_main_colors(decoded.pixels(self.SAMPLE_SIZE))
+
+
+class FaceAnalyzer(Analyzer):
+    name = 'faces'
+    DETECT_SIZE = 1080  # Haar detection on full 24MP frames is far too slow
+    input_side = DETECT_SIZE
+
+    def analyze(self, decoded):
+        # Imported here so the pipeline works without the gender model files
+        from .face_detect import face_tags
+        return face_tags(decoded.pixels(self.DETECT_SIZE))
+
+
+class EmbeddedKeywordsAnalyzer(Analyzer):
+    """Keywords already written into the file's IPTC/XMP metadata, e.g. by a photo manager."""
+    name = 'embedded'
+    input_side = 0  # Reads the file's metadata, not the pixels
+
+    def analyze(self, decoded):
+        from .previews import read_keywords
+        return read_keywords(decoded.path)
+
+
+class OCRAnalyzer(Analyzer):
+    name = 'ocr'
+    enabled = False  # Tesseract is slow, only run it when asked for
+    asynchronous = True
+
+    def __init__(self, localDB, workers=2):
+        self.localDB = localDB
+        self.workers = workers
+        self.stage = None
+
+    def set_workers(self, workers):
+        self.workers = workers
+        if self.stage is not None:
+            self.stage.resize(workers)
+
+    def analyze(self, decoded):
+        # Imported here so the pipeline works without tesseract installed
+        from .text_extract import OCRStage
+        if self.stage is None:
+            self.stage = OCRStage(self.localDB, workers=self.workers)
+        return self.stage.extract(decoded)
+
+    def collect(self, text):
+        from .text_extract import text_to_tags
+        return text_to_tags(text)
+
+
+class StageStats:
+    """Per-stage call count, total and worst-case time in seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds, max(worst, seconds))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    'count': count,
+                    'total_seconds': total,
+                    'mean_seconds': total / count,
+                    'max_seconds': worst,
+                }
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+
+class PipelineResult:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.tags = OrderedDict()  # analyzer name -> tags
+        self.timings = OrderedDict()  # stage name -> seconds
+        self.errors = {}  # analyzer name -> error message
+        self.outputs = {}  # Non-tag outputs shared through the DecodedImage
+        self.reused_from = None  # Name of the near-duplicate whose tags were reused
+        self.versions = {}  # analyzer name -> version, for the analyzers that succeeded
+
+    def all_tags(self):
+        merged = []
+        for tags in self.tags.values():
+            for tag in tags:
+                if tag not in merged:
+                    merged.append(tag)
+        return merged
+
+
+class Pipeline:
+    """Decodes each file once and fans the pixels out to the enabled analyzers.
+
+    If reuse is set, it is called after the 'phash' analyzer with the
+    DecodedImage and may return (name, sources) of an already processed
+    near-duplicate, sources as from LocalDB.get_tag_sources. Those are then
+    used instead of running the rest: analyzer outputs are copied with their
+    versions, so the copy is only stale where the duplicate's output is, and
+    unversioned sources such as the user's are merged into 'reused'.
+    """
+
+    def __init__(self, analyzers, reuse=None, max_decode_pixels=MAX_DECODE_PIXELS, admission=None,
+                 max_full_decode_pixels=MAX_FULL_DECODE_PIXELS):
+        self.analyzers = OrderedDict((analyzer.name, analyzer) for analyzer in analyzers)
+        self.stats = StageStats()
+        self.reuse = reuse
+        self.max_decode_pixels = max_decode_pixels
+        self.max_full_decode_pixels = max_full_decode_pixels  # For formats without reduced decoding
+        self.admission = admission  # Optional PixelBudget shared by concurrent process() calls
+
+    def set_enabled(self, name, enabled):
+        if name not in self.analyzers:
+            raise KeyError(f"Unknown analyzer: {name}")
+        self.analyzers[name].enabled = bool(enabled)
+
+    def enabled_analyzers(self, only=None):
+        """Enabled analyzers, or the ones named in only (enabled or not) if it is given."""
+        if only is not None:
+            return [analyzer for name, analyzer in self.analyzers.items() if name in only]
+        return [analyzer for analyzer in self.analyzers.values() if analyzer.enabled]
+
+    def versions(self, only=None):
+        return {analyzer.name: analyzer.version for analyzer in self.enabled_analyzers(only)}
+
+    def input_side(self, only=None):
+        """Shorter side the analyzers need decoded, or None for full resolution."""
+        sides = [analyzer.input_side for analyzer in self.enabled_analyzers(only)]
+        if any(side is None for side in sides):
+            return None
+        return max(sides, default=0)
+
+    def open(self, path, only=None):
+        """The not yet decoded image process() would work on; its size is the decode cost."""
+        return open_reduced(path, self.input_side(only), self.max_decode_pixels, self.max_full_decode_pixels)
+
+    def describe(self):
+        return {name: analyzer.enabled for name, analyzer in self.analyzers.items()}
+
+    def _record(self, result, stage, start):
+        elapsed = time.perf_counter() - start
+        result.timings[stage] = elapsed
+        self.stats.record(stage, elapsed)
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+
+    def _failed(self, result, analyzer, error):
+        logger.error(f"Analyzer {analyzer.name} failed for {result.path}: {str(error)}")
+        result.tags.pop(analyzer.name, None)
+        result.errors[analyzer.name] = str(error)
+        STAGE_ERRORS.labels(analyzer.name).inc()
+
+    def process(self, path, only=None):
+        """Run the enabled analyzers on path, or just the ones named in only (e.g. to
+        recompute stale outputs; near-duplicate reuse is skipped then)."""
+        image = self.open(path, only)
+        if self.admission is None:
+            return self._process(path, image, only)
+        pixels = image.width * image.height
+        try:
+            self.admission.acquire(pixels)
+        except ImageTooLarge:
+            image.close()
+            raise
+        try:
+            return self._process(path, image, only)
+        finally:
+            self.admission.release(pixels)
+
+    def _process(self, path, image, only=None):
+        result = PipelineResult(path)
+        start = time.perf_counter()
+        try:
+            decoded = DecodedImage.decode(path, image, self.max_decode_pixels)
+        finally:
+            self._record(result, 'decode', start)
+
+        result.outputs = decoded.outputs
+        analyzers = self.enabled_analyzers(only)
+        if only is None and self.reuse is not None and 'phash' in self.analyzers and self.analyzers['phash'].enabled:
+            hasher = self.analyzers['phash']
+            analyzers.remove(hasher)
+            start = time.perf_counter()
+            try:
+                hasher.analyze(decoded)
+                self._record(result, hasher.name, start)
+                result.tags[hasher.name] = []  # No tags, but stores the version like any analyzer run
+                result.versions[hasher.name] = hasher.version
+            except Exception as e:
+                self._failed(result, hasher, e)
+            else:
+                match = self.reuse(decoded)
+                if match is not None:
+                    result.reused_from, sources = match
+                    for source, (tags, version) in sources.items():
+                        if source == hasher.name:
+                            continue
+                        if version is None:
+                            result.tags.setdefault(REUSED_SOURCE, []).extend(tags)
+                        else:
+                            result.tags[source] = tags
+                            result.versions[source] = version
+                    return result
+
+        for analyzer in analyzers:
+            result.tags[analyzer.name] = []  # Keep tags in analyzer order
+        pending = []
+        # Start asynchronous analyzers first so they overlap with the rest
+        for analyzer in sorted(analyzers, key=lambda a: not a.asynchronous):
+            start = time.perf_counter()
+            try:
+                value = analyzer.analyze(decoded)
+            except Exception as e:
+                self._failed(result, analyzer, e)
+                continue
+            if isinstance(value, Future):
+                pending.append((analyzer, value, start))
+            else:
+                result.tags[analyzer.name] = value
+                self._record(result, analyzer.name, start)
+
+        for analyzer, future, start in pending:
+            try:
+                result.tags[analyzer.name] = analyzer.collect(future.result())
+                self._record(result, analyzer.name, start)
+            except Exception as e:
+                self._failed(result, analyzer, e)
+        result.versions.update((analyzer.name, analyzer.version) for analyzer in analyzers
+                               if analyzer.name in result.tags)
+        return result
+
+
+def save_result(localDB, result, embedding_store=None, duplicate_index=None, wait=True):
+    """Write a PipelineResult's tags, perceptual hash and embedding to the catalog.
+
+    Each analyzer's tags replace that analyzer's source through the catalog's
+    TagWriter, so user edits and analyzers that did not run are kept. With
+    wait=False the hash and embedding are stored once the tags have committed;
+    call TagWriter.get(localDB).flush() before relying on them.
+    """
+    tags = result.all_tags()
+    future = TagWriter.get(localDB).replace_sources(result.name, result.tags, result.path, result.versions)
+
+    def store_outputs(done):
+        image_id = done.result()
+        if embedding_store is not None:
+            embedding = result.outputs.get('embedding')
+            if embedding is None and result.reused_from:
+                duplicate_id = localDB.get_image_id(result.reused_from)
+                embedding = embedding_store.get(duplicate_id) if duplicate_id is not None else None
+            if embedding is not None:
+                embedding_store.put(image_id, embedding)
+        if 'phash' in result.outputs:
+            localDB.set_phash(result.name, result.outputs['phash'])
+            if duplicate_index is not None:
+                duplicate_index.add(result.name, result.outputs['phash'])
+
+    if wait:
+        store_outputs(future)
+    else:
+        def store_logged(done):
+            try:
+                store_outputs(done)
+            except Exception as e:
+                logger.error(f"Error saving {result.name}: {str(e)}")
+        future.add_done_callback(store_logged)
+    return tags
+
+
+def default_pipeline(localDB):
+    return Pipeline([
+        HashAnalyzer(),
+        ClassifierAnalyzer(),
+        ColorAnalyzer(localDB),
+        FaceAnalyzer(),
+        EmbeddedKeywordsAnalyzer(),
+        OCRAnalyzer(localDB),
+    ], admission=PixelBudget())
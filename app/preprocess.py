@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+from PIL import Image
+
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# uint8 -> normalized float32 lookup table, one row per channel.
+# Indexing it with the pixel buffer converts and normalizes in a single pass.
+_NORMALIZE_LUT = (
+    (np.arange(256, dtype=np.float32)[None, :] / 255.0 - np.array(MEAN, dtype=np.float32)[:, None])
+    / np.array(STD, dtype=np.float32)[:, None]
+).astype(np.float32)
+_CHANNELS = np.arange(3)
+
+
+def open_for_classifier(image_path):
+    """Open an image, letting the JPEG decoder downscale to about RESIZE_SIZE."""
+    image = Image.open(image_path)
+    # draft() only changes JPEG decoding; the result is never smaller than requested
+    image.draft('RGB', (RESIZE_SIZE, RESIZE_SIZE))
+    return image
+
+
+def crop_box(width, height):
+    """Source region that Resize(RESIZE_SIZE) + CenterCrop(CROP_SIZE) would keep."""
+    scale = RESIZE_SIZE / min(width, height)
+    side = CROP_SIZE / scale
+    left = (width - side) / 2
+    top = (height - side) / 2
+    return (left, top, left + side, top + side)
+
+
+def preprocess_image(image):
+    """Turn a PIL image into a normalized 1x3x224x224 channels-last float tensor."""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    # Resize and center crop in one resample over just the cropped region
+    image = image.resize((CROP_SIZE, CROP_SIZE), Image.BILINEAR,
+                         box=crop_box(*image.size), reducing_gap=3.0)
+    pixels = np.asarray(image)
+    # HWC float32, which is exactly channels-last once viewed as NCHW
+    normalized = _NORMALIZE_LUT[_CHANNELS, pixels]
+    return torch.from_numpy(normalized).permute(2, 0, 1).unsqueeze(0)
+
+
+def load_classifier_input(image_path):
+    with open_for_classifier(image_path) as image:
+        return preprocess_image(image)
@@ -0,0 +1,112 @@
+"""Cheap previews and embedded keywords straight from image metadata.
+
+Most camera JPEGs carry a large preview, often about 1920px, as a second
+image in an MPF (APP2) segment, which Pillow opens as an extra frame. When one
+is big enough for the requested size it is decoded instead of the photo.
+Otherwise the file is opened with Image.draft, which lets libjpeg decode at
+1/2, 1/4 or 1/8 scale. Either way the full-resolution image is never decoded
+just to show a preview. The ~160px EXIF thumbnail is too small for any
+preview the GUI shows, so it is not used.
+"""
+import logging
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# EXIF orientation -> PIL transpose that undoes it
+_ORIENTATION = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.ROTATE_90, Image.FLIP_TOP_BOTTOM),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_270, Image.FLIP_TOP_BOTTOM),
+    8: (Image.ROTATE_90,),
+}
+
+KEYWORD_KEYS = ('Iptc.Application2.Keywords', 'Xmp.dc.subject')
+ORIENTATION_TAG = 0x0112
+MP_ENTRIES = 0xB002  # MPF tag listing the images in the file
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(',')]
+    return [str(part).strip() for part in value]
+
+
+def read_keywords(path):
+    """IPTC keywords and XMP dc:subject entries already embedded in the file."""
+    import pyexiv2  # Only needed for keywords, not for previews
+    with pyexiv2.Image(path) as metadata:
+        iptc = metadata.read_iptc()
+        xmp = metadata.read_xmp()
+    keywords = []
+    for key in KEYWORD_KEYS:
+        for keyword in _as_list(iptc.get(key) or xmp.get(key)):
+            if keyword and keyword not in keywords:
+                keywords.append(keyword)
+    return keywords
+
+
+def _orientation(image):
+    """EXIF orientation from the header Pillow has already parsed."""
+    try:
+        return int(image.getexif().get(ORIENTATION_TAG, 1))
+    except (TypeError, ValueError, SyntaxError):
+        return 1
+
+
+def _orient(image, orientation):
+    for method in _ORIENTATION.get(orientation, ()):
+        image = image.transpose(method)
+    return image
+
+
+def _seek_preview(image, min_side):
+    """Move an MPF image to its smallest large thumbnail whose longer side
+    reaches min_side. Returns whether there was one; else stays on the photo."""
+    entries = (getattr(image, 'mpinfo', None) or {}).get(MP_ENTRIES) or []
+    best = None
+    for frame, entry in enumerate(entries[:getattr(image, 'n_frames', 1)]):
+        if not entry.get('Attribute', {}).get('MPType', '').startswith('Large Thumbnail'):
+            continue  # Stereo pairs and panorama parts are not previews
+        image.seek(frame)
+        side = max(image.size)
+        if side >= min_side and (best is None or side < best[1]):
+            best = (frame, side)
+    image.seek(best[0] if best else 0)
+    return best is not None
+
+
+def load_preview(path, max_side, min_side=None):
+    """RGB PIL image of path whose longer side is at most max_side.
+
+    Uses an embedded large preview if its longer side reaches min_side
+    (default: max_side), and a reduced-scale decode of the file otherwise.
+    """
+    with Image.open(path) as image:
+        orientation = _orientation(image)  # The primary image's; previews may carry none
+        try:
+            found = _seek_preview(image, min_side or max_side)
+        except Exception as e:
+            logger.debug(f"Unusable embedded preview in {path}: {str(e)}")
+            found = None
+        if found is not None:
+            if found:
+                logger.debug(f"Using the embedded preview of {path}")
+            return _reduced(image, max_side, orientation)
+    # A broken MPF index can leave the file mid-seek; decode the photo from a fresh handle
+    with Image.open(path) as image:
+        return _reduced(image, max_side, orientation)
+
+
+def _reduced(image, max_side, orientation):
+    """Decode the current frame of image as an oriented RGB copy within max_side."""
+    image.draft('RGB', (max_side, max_side))  # JPEG only; other formats ignore it
+    image = _orient(image.convert('RGB'), orientation)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
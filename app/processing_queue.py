@@ -0,0 +1,75 @@
+import heapq
+import itertools
+import threading
+
+# Higher runs first
+BACKLOG = 0
+VISIBLE = 1
+SELECTED = 2
+PRIORITIES = {'backlog': BACKLOG, 'visible': VISIBLE, 'selected': SELECTED}
+
+
+class ProcessingQueue:
+    """Files waiting for the pipeline, the ones a user is looking at first.
+
+    The backlog is served in submission order. bump() raises queued files to a
+    higher priority; within a priority the most recent bump goes first, so
+    the image a user just clicked is next. Raised entries are pushed again and
+    the old heap entries are skipped when they surface.
+    """
+
+    def __init__(self):
+        self._heap = []  # (-priority, order, path)
+        self._entries = {}  # path -> (-priority, order) of its live heap entry
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def put(self, path, priority=BACKLOG):
+        with self._lock:
+            if path not in self._entries:
+                self._push(path, -priority, next(self._order))
+
+    def _push(self, path, key, order):
+        self._entries[path] = (key, order)
+        heapq.heappush(self._heap, (key, order, path))
+
+    def bump(self, paths, priority=SELECTED):
+        """Move queued paths ahead of lower priorities, the first path first.
+
+        Paths that are not queued (already processed, or unknown) are ignored.
+        Returns how many were raised.
+        """
+        bumped = 0
+        with self._lock:
+            for path in reversed(list(paths)):
+                entry = self._entries.get(path)
+                if entry is None or entry[0] < -priority:
+                    continue  # Not queued, or already above this priority
+                self._push(path, -priority, -next(self._order))
+                bumped += 1
+            if len(self._heap) > 4 * len(self._entries) + 1024:
+                # Scrolling bumps the same rows over and over; drop the stale entries
+                self._heap = [(key, order, path) for path, (key, order) in self._entries.items()]
+                heapq.heapify(self._heap)
+        return bumped
+
+    def pop(self):
+        """Next path to process, or None once the queue is empty."""
+        with self._lock:
+            while self._heap:
+                key, order, path = heapq.heappop(self._heap)
+                if self._entries.get(path) == (key, order):
+                    del self._entries[path]
+                    return path
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._entries.clear()
@@ -0,0 +1,129 @@
+"""In-memory read replica of a catalog for search-heavy deployments.
+
+The catalog is copied into a shared-cache in-memory SQLite database with the
+backup API, and every LocalDB read is answered from the copy. Readers open it
+with read_uncommitted, so they never wait for a writer's locks, and they
+never touch the file that a processing run is writing to.
+
+Two modes keep the copy current:
+
+- write-through: each write is committed to the file, then repeated on the
+  copy. Reads see a write as soon as it has committed. Catalog-wide writes
+  such as reset_database and merge_from reload the whole copy instead.
+- refresh: the copy is reloaded every refresh_interval seconds if the file
+  has changed, including changes made by other processes (e.g. the CLI).
+  Reads may lag behind writes by up to one interval.
+"""
+import time
+import sqlite3
+import logging
+import itertools
+import threading
+
+from .localDB import LocalDB, _ThreadConnection
+
+logger = logging.getLogger(__name__)
+
+WRITE_THROUGH = 'write-through'
+REFRESH = 'refresh'
+DEFAULT_REFRESH_INTERVAL = 30.0  # Seconds
+
+_names = itertools.count()
+
+
+class ReadReplica:
+    def __init__(self, localDB, mode=WRITE_THROUGH, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        if mode not in (WRITE_THROUGH, REFRESH):
+            raise ValueError(f"Unknown replica mode: {mode}")
+        self.localDB = localDB
+        self.mode = mode
+        self.write_through = mode == WRITE_THROUGH
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()  # Held across a file write and its replay
+        self._local = threading.local()
+        self._keeper = None  # Keeps the current in-memory database alive
+        self._source = sqlite3.connect(localDB.DATABASE, check_same_thread=False)
+        self._data_version = None
+        self.uri = None
+        self.refresh()
+        self._stop = threading.Event()
+        self._thread = None
+        if mode == REFRESH:
+            self._thread = threading.Thread(target=self._run, name='read-replica', daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def attach(cls, localDB, mode=WRITE_THROUGH, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        replica = LocalDB.read_replicas.get(localDB.DATABASE)
+        if replica is None:
+            replica = LocalDB.read_replicas[localDB.DATABASE] = cls(localDB, mode, refresh_interval)
+        return replica
+
+    @classmethod
+    def detach(cls, localDB):
+        replica = LocalDB.read_replicas.pop(localDB.DATABASE, None)
+        if replica is not None:
+            replica.close()
+
+    def refresh(self):
+        """Reload the copy from the file with the backup API, then switch readers to it.
+
+        The new copy gets a new name, so queries running on the old one finish
+        undisturbed; each thread moves over on its next read.
+        """
+        start = time.perf_counter()
+        uri = f"file:imagetagger-replica-{next(_names)}?mode=memory&cache=shared"
+        keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        with self.lock:  # In write-through mode no write may land between the copy and the switch
+            self._source.backup(keeper)
+            self._data_version = self._source.execute("PRAGMA data_version").fetchone()[0]
+            old, self._keeper, self.uri = self._keeper, keeper, uri
+        if old is not None:
+            old.close()
+        # Searches cached while the old copy was current may be out of date
+        self.localDB.bump_write_generation()
+        logger.info(f"Read replica of {self.localDB.DATABASE} loaded in {time.perf_counter() - start:.2f}s")
+
+    def connection(self):
+        """The calling thread's connection to the current copy."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.uri != self.uri:
+            if conn is not None:
+                sqlite3.Connection.close(conn)  # _ThreadConnection.close() keeps it open
+            uri = self.uri
+            conn = sqlite3.connect(uri, uri=True, factory=_ThreadConnection)
+            conn.execute("PRAGMA read_uncommitted = 1")  # Do not wait for the replay writer's table locks
+            self._local.conn, self._local.uri = conn, uri
+        return conn
+
+    def replay(self, write):
+        """Repeat write(cursor), already committed to the file, on the copy. Call with lock held."""
+        try:
+            with self._keeper:
+                write(self._keeper.cursor())
+        except Exception as e:
+            logger.error(f"Read replica of {self.localDB.DATABASE} diverged, reloading: {str(e)}")
+            self.refresh()
+
+    def changed(self):
+        """Whether the file has been written to, by any connection, since the last refresh."""
+        with self.lock:
+            return self._source.execute("PRAGMA data_version").fetchone()[0] != self._data_version
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if self.changed():
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Could not refresh the read replica of {self.localDB.DATABASE}: {str(e)}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self.lock:
+            if self._keeper is not None:
+                self._keeper.close()
+                self._keeper = None
+            self._source.close()
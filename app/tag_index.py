@@ -0,0 +1,459 @@
+import heapq
+import bisect
+import threading
+from array import array
+from collections import Counter
+import numpy as np
+
+from .localDB import LocalDB, normalize_search_tags
+from .metrics import cache_result
+
+# Highest code point, so (prefix + _END) sorts after every key starting with prefix
+_END = '\U0010ffff'
+
+
+def _matches(term, tag, lower):
+    """Whether LIKE '%term%' matches tag; LIKE ignores case for ASCII only."""
+    return term in (lower if term.isascii() else tag)
+
+
+class TagVocabulary:
+    """Every tag in the catalog with its image count, kept in sync with save_tags.
+
+    Keys are (lowercased tag, tag) pairs in one sorted list, so a prefix is a
+    bisect range. Counts live in a dict and change in place; the sorted list
+    only changes when a tag appears or disappears.
+    """
+
+    def __init__(self, localDB, memo_size=1024):
+        self.localDB = localDB
+        self.memo_size = memo_size
+        self._lock = threading.Lock()
+        self._memo = {}  # (prefix, limit) -> suggestions, cleared on any change
+        self._matched = {}  # query -> vocabulary tags it matches, updated as tags come and go
+        self._facets = {}  # (query, limit) -> facets from a scan, dropped when a matching image changes
+        self._load()
+        LocalDB.tag_listeners.append(self._on_tags_changed)
+        LocalDB.reset_callbacks.append(self._load)
+
+    def _load(self):
+        counts = self.localDB.get_tag_counts()
+        with self._lock:
+            self.counts = counts
+            self.keys = sorted((tag.lower(), tag) for tag in counts)
+            self._memo.clear()
+            self._matched.clear()
+            self._facets.clear()
+
+    def _on_tags_changed(self, database, image_name, old_tags, new_tags, file_location=None):
+        if database != self.localDB.DATABASE:
+            return
+        old_tags, new_tags = set(old_tags), set(new_tags)
+        with self._lock:
+            for tag in new_tags - old_tags:
+                if tag not in self.counts:
+                    bisect.insort(self.keys, (tag.lower(), tag))
+                    for query, matched in self._matched.items():
+                        if any(_matches(term, tag, tag.lower()) for term in query):
+                            matched.append(tag)
+                self.counts[tag] = self.counts.get(tag, 0) + 1
+            for tag in old_tags - new_tags:
+                count = self.counts.get(tag, 0) - 1
+                if count > 0:
+                    self.counts[tag] = count
+                elif tag in self.counts:
+                    del self.counts[tag]
+                    index = bisect.bisect_left(self.keys, (tag.lower(), tag))
+                    if index < len(self.keys) and self.keys[index][1] == tag:
+                        del self.keys[index]
+                    for matched in self._matched.values():
+                        if tag in matched:
+                            matched.remove(tag)
+            self._memo.clear()
+            # Only searches whose result set holds this image, before or after, see different counts
+            changed = [(tag, tag.lower()) for tag in old_tags | new_tags]
+            for key in [key for key in self._facets
+                        if any(_matches(term, tag, lower) for term in key[0] for tag, lower in changed)]:
+                del self._facets[key]
+
+    def __len__(self):
+        return len(self.counts)
+
+    def count(self, tag):
+        return self.counts.get(tag, 0)
+
+    def autocomplete(self, prefix, limit=10):
+        """Most used tags starting with prefix (case-insensitive), as (tag, count) pairs."""
+        prefix = prefix.strip().lower()
+        memo_key = (prefix, limit)
+        with self._lock:
+            suggestions = self._memo.get(memo_key)
+            if suggestions is None:
+                low = bisect.bisect_left(self.keys, (prefix,))
+                high = bisect.bisect_left(self.keys, (prefix + _END,))
+                best = heapq.nlargest(limit, (tag for _, tag in self.keys[low:high]), key=self.counts.__getitem__)
+                suggestions = [(tag, self.counts[tag]) for tag in best]
+                if len(self._memo) >= self.memo_size:
+                    self._memo.clear()
+                self._memo[memo_key] = suggestions
+        return suggestions
+
+    def matching_tags(self, query):
+        """Vocabulary tags that a search for the normalized query matches."""
+        with self._lock:
+            matched = self._matched.get(query)
+            if matched is None:
+                if len(self._matched) >= self.memo_size:
+                    self._matched.clear()
+                matched = self._matched[query] = [tag for lower, tag in self.keys
+                                                  if any(_matches(term, tag, lower) for term in query)]
+            return list(matched)
+
+    def facets(self, tags, limit=20):
+        """Counts of tags co-occurring in the images a search for tags returns.
+
+        Returns (number of matching images, [(tag, count)]), skipping the
+        searched tags. With a TagIndex attached, the union of the matched
+        tags' postings is intersected with the other tags' postings, most used
+        tag first, until no tag's image count could still make the top list.
+        Without one the matching rows are scanned, and the result is cached
+        until an image in the result set changes.
+        """
+        query = normalize_search_tags(tags)
+        searched = set(query)
+        matched = self.matching_tags(query)
+
+        def wanted(tag):
+            return (tag.lower() if tag.isascii() else tag) not in searched
+
+        if not matched:
+            return 0, []
+
+        index = LocalDB.tag_indexes.get(self.localDB.DATABASE)
+        if index is not None:
+            with self._lock:
+                by_count = [(-count, tag) for tag, count in self.counts.items()]
+            heapq.heapify(by_count)
+
+            def candidates():
+                # A tag's image count bounds how many of the matching images carry it
+                while by_count:
+                    count, tag = heapq.heappop(by_count)
+                    if wanted(tag):
+                        yield tag, -count
+
+            return index.top_overlaps(matched, candidates(), limit)
+
+        key = (query, limit)
+        with self._lock:
+            cached = self._facets.get(key)
+        cache_result('facets', cached is not None)
+        if cached is not None:
+            return cached
+        matches = self.localDB.get_tags_matching(query)
+        counter = Counter(tag for image_tags in matches for tag in set(image_tags))
+        result = (len(matches), [(tag, count) for tag, count in counter.most_common() if wanted(tag)][:limit])
+        with self._lock:
+            if len(self._facets) >= self.memo_size:
+                self._facets.clear()
+            self._facets[key] = result
+        return result
+
+
+class TagIndex:
+    """In-memory inverted index over the catalog for SQL-free searches.
+
+    Tags are interned to small ints and images to dense slots, and each tag
+    keeps a sorted uint32 array of the slots carrying it: four bytes per
+    (image, tag) pair instead of a list of tag strings per image. Changes from
+    save_tags are buffered per tag and folded into its array the next time
+    the tag is queried. Register one per database with attach(); from then on
+    LocalDB.search_images answers from it.
+    """
+
+    def __init__(self, localDB):
+        self.localDB = localDB
+        self._lock = threading.RLock()
+        self._load()
+        LocalDB.tag_listeners.append(self._on_tags_changed)
+        LocalDB.reset_callbacks.append(self._load)
+
+    @classmethod
+    def attach(cls, localDB):
+        index = LocalDB.tag_indexes.get(localDB.DATABASE)
+        if index is None:
+            index = LocalDB.tag_indexes[localDB.DATABASE] = cls(localDB)
+        return index
+
+    @classmethod
+    def detach(cls, localDB):
+        LocalDB.tag_indexes.pop(localDB.DATABASE, None)
+
+    def _load(self):
+        names, locations, slots = [], [], {}
+        tag_ids, tag_names, postings = {}, [], []
+        for slot, (name, file_location, tags) in enumerate(self.localDB.iter_catalog()):
+            names.append(name)
+            locations.append(file_location)
+            slots[name] = slot
+            for tag in set(tags):
+                tag_id = tag_ids.get(tag)
+                if tag_id is None:
+                    tag_id = tag_ids[tag] = len(tag_names)
+                    tag_names.append(tag)
+                    postings.append(array('I'))
+                postings[tag_id].append(slot)  # Slots only grow, so each list stays sorted
+
+        with self._lock:
+            self.names = names
+            self.locations = locations
+            self.slots = slots
+            self.tag_ids = tag_ids
+            self.tag_names = tag_names
+            self.tag_lower = [tag.lower() for tag in tag_names]
+            self.postings = [np.frombuffer(posting, dtype=np.uint32) if posting else np.empty(0, np.uint32)
+                             for posting in postings]
+            self._pending = {}  # tag id -> (slots to add, slots to remove)
+
+    def _intern(self, tag):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+            self.tag_lower.append(tag.lower())
+            self.postings.append(np.empty(0, np.uint32))
+        return tag_id
+
+    def _on_tags_changed(self, database, image_name, old_tags, new_tags, file_location=None):
+        if database != self.localDB.DATABASE:
+            return
+        old_tags, new_tags = set(old_tags), set(new_tags)
+        with self._lock:
+            slot = self.slots.get(image_name)
+            if slot is None:
+                slot = self.slots[image_name] = len(self.names)
+                self.names.append(image_name)
+                self.locations.append(file_location)
+            elif file_location:
+                self.locations[slot] = file_location
+            for tag in new_tags - old_tags:
+                adds, removes = self._pending.setdefault(self._intern(tag), (set(), set()))
+                removes.discard(slot)
+                adds.add(slot)
+            for tag in old_tags - new_tags:
+                tag_id = self.tag_ids.get(tag)
+                if tag_id is not None:
+                    adds, removes = self._pending.setdefault(tag_id, (set(), set()))
+                    adds.discard(slot)
+                    removes.add(slot)
+
+    def _posting(self, tag_id):
+        pending = self._pending.pop(tag_id, None)
+        if pending:
+            adds, removes = pending
+            posting = self.postings[tag_id]
+            if removes:
+                posting = posting[~np.isin(posting, np.fromiter(removes, np.uint32, len(removes)))]
+            if adds:
+                posting = np.union1d(posting, np.fromiter(adds, np.uint32, len(adds))).astype(np.uint32)
+            self.postings[tag_id] = posting
+        return self.postings[tag_id]
+
+    def _union(self, tag_ids):
+        postings = [self._posting(tag_id) for tag_id in tag_ids]
+        if not postings:
+            return np.empty(0, np.uint32)
+        if len(postings) == 1:
+            return postings[0]
+        return np.unique(np.concatenate(postings))
+
+    def _exact_ids(self, tag):
+        tag = tag.strip().lower()
+        return [tag_id for tag_id, lower in enumerate(self.tag_lower) if lower == tag]
+
+    def _results(self, slots):
+        return [(self.names[slot], self.locations[slot]) for slot in slots]
+
+    def search(self, all_of=(), any_of=(), none_of=()):
+        """Boolean search on whole tags (case-insensitive): every all_of tag,
+        at least one any_of tag, and no none_of tag. Returns (name, file_location)."""
+        with self._lock:
+            result = None
+            # Intersect starting from the rarest tag to keep the candidate set small
+            required = sorted((self._union(self._exact_ids(tag)) for tag in all_of), key=len)
+            for posting in required:
+                result = posting if result is None else result[np.isin(result, posting, assume_unique=True)]
+            if any_of:
+                alternatives = self._union([tag_id for tag in any_of for tag_id in self._exact_ids(tag)])
+                result = alternatives if result is None else result[np.isin(result, alternatives, assume_unique=True)]
+            if result is None:
+                result = np.arange(len(self.names), dtype=np.uint32)
+            if none_of:
+                excluded = self._union([tag_id for tag in none_of for tag_id in self._exact_ids(tag)])
+                result = result[~np.isin(result, excluded)]
+            return self._results(result)
+
+    def search_like(self, terms, tags=()):
+        """Same matches as LocalDB's LIKE '%term%' OR query, resolved through the
+        vocabulary, plus the images carrying any of tags exactly."""
+        with self._lock:
+            terms = [term.lower() for term in terms]
+            tag_ids = {tag_id for tag_id, lower in enumerate(self.tag_lower) if any(term in lower for term in terms)}
+            tag_ids.update(self.tag_ids[tag] for tag in tags if tag in self.tag_ids)
+            return self._results(self._union(sorted(tag_ids)))
+
+    def top_overlaps(self, tags, candidates, limit):
+        """Size of the union of tags' images, and the limit candidates most common in it.
+
+        candidates are (tag, upper bound on its count) pairs, highest bound
+        first. They are counted exactly until no later bound could still make
+        the top limit. Returns (number of images, [(tag, count)]).
+        """
+        with self._lock:
+            slots = self._union([self.tag_ids[tag] for tag in tags if tag in self.tag_ids])
+            best = []  # Min-heap of (count, tag)
+            if not len(slots) or limit <= 0:
+                return len(slots), []
+            for tag, bound in candidates:
+                if len(best) >= limit and best[0][0] >= bound:
+                    break
+                tag_id = self.tag_ids.get(tag)
+                if tag_id is None:
+                    continue
+                posting = self._posting(tag_id)
+                # Both arrays are sorted, so a binary search per slot finds the shared ones
+                positions = np.minimum(np.searchsorted(slots, posting), len(slots) - 1)
+                count = int(np.count_nonzero(slots[positions] == posting))
+                if not count:
+                    continue
+                if len(best) < limit:
+                    heapq.heappush(best, (count, tag))
+                elif (count, tag) > best[0]:
+                    heapq.heapreplace(best, (count, tag))
+            return len(slots), [(tag, count) for count, tag in sorted(best, reverse=True)]
+
+    def memory_bytes(self):
+        """Bytes held by the posting arrays."""
+        with self._lock:
+            return sum(posting.nbytes for posting in self.postings)
+
+
+def trigrams(term):
+    """Trigrams of a lowercased term padded like pg_trgm: two spaces before, one after."""
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Typo-tolerant lookup of catalog tags by trigram overlap.
+
+    Terms are the lowercased tags and the words inside multi-word tags (OCR
+    text arrives as one tag per word). Each trigram maps to the ids of the
+    terms that contain it. A query term only visits the postings of its own
+    trigrams, so lookups scale with the vocabulary those trigrams reach,
+    never with the number of images. Candidates are ranked by Jaccard
+    similarity of their trigram sets, as pg_trgm's similarity() does. Kept in
+    sync with save_tags; register one per database with attach(), and
+    LocalDB.search_images(tags, fuzzy=True) expands queries through it.
+    """
+
+    def __init__(self, localDB, threshold=0.3):
+        self.localDB = localDB
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._load()
+        LocalDB.tag_listeners.append(self._on_tags_changed)
+        LocalDB.reset_callbacks.append(self._load)
+
+    @classmethod
+    def attach(cls, localDB, threshold=0.3):
+        index = LocalDB.trigram_indexes.get(localDB.DATABASE)
+        if index is None:
+            index = LocalDB.trigram_indexes[localDB.DATABASE] = cls(localDB, threshold)
+        return index
+
+    @classmethod
+    def detach(cls, localDB):
+        LocalDB.trigram_indexes.pop(localDB.DATABASE, None)
+
+    def _load(self):
+        counts = self.localDB.get_tag_counts()
+        with self._lock:
+            self.counts = {}  # tag -> images carrying it
+            self.term_ids = {}
+            self.terms = []  # term id -> term
+            self.term_grams = []  # term id -> its trigram set
+            self.term_tags = []  # term id -> {tag: None}, the tags containing the term
+            self.postings = {}  # trigram -> set of term ids
+            for tag, count in counts.items():
+                self._add_tag(tag, count)
+
+    @staticmethod
+    def _terms(tag):
+        lower = tag.lower()
+        words = lower.split()
+        return [lower] + (words if len(words) > 1 else [])
+
+    def _add_tag(self, tag, count=1):
+        known = tag in self.counts
+        self.counts[tag] = self.counts.get(tag, 0) + count
+        if known:
+            return
+        for term in self._terms(tag):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.terms)
+                grams = trigrams(term)
+                self.terms.append(term)
+                self.term_grams.append(grams)
+                self.term_tags.append({})
+                for gram in grams:
+                    self.postings.setdefault(gram, set()).add(term_id)
+            self.term_tags[term_id][tag] = None
+
+    def _remove_tag(self, tag):
+        count = self.counts.get(tag, 0) - 1
+        if count > 0:
+            self.counts[tag] = count
+            return
+        self.counts.pop(tag, None)
+        # The term keeps its id and postings; with no tags left it just never matches
+        for term in self._terms(tag):
+            term_id = self.term_ids.get(term)
+            if term_id is not None:
+                self.term_tags[term_id].pop(tag, None)
+
+    def _on_tags_changed(self, database, image_name, old_tags, new_tags, file_location=None):
+        if database != self.localDB.DATABASE:
+            return
+        old_tags, new_tags = set(old_tags), set(new_tags)
+        with self._lock:
+            for tag in new_tags - old_tags:
+                self._add_tag(tag)
+            for tag in old_tags - new_tags:
+                self._remove_tag(tag)
+
+    def similar(self, term, limit=10, threshold=None):
+        """Terms similar to term, as (term, similarity) pairs, most similar first."""
+        threshold = self.threshold if threshold is None else threshold
+        grams = trigrams(term.strip().lower())
+        with self._lock:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+            scored = []
+            for term_id, overlap in shared.items():
+                if not self.term_tags[term_id]:
+                    continue
+                similarity = overlap / (len(grams) + len(self.term_grams[term_id]) - overlap)
+                if similarity >= threshold:
+                    scored.append((similarity, self.terms[term_id]))
+        return [(match, similarity) for similarity, match in heapq.nlargest(limit, scored)]
+
+    def expand(self, term, limit=10, threshold=None):
+        """Catalog tags containing a term similar to term, best match first."""
+        tags = {}
+        for match, _ in self.similar(term, limit, threshold):
+            with self._lock:
+                tags.update(self.term_tags[self.term_ids[match]])
+        return list(tags)
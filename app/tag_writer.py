@@ -0,0 +1,159 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+from .localDB import TagMutation, USER_SOURCE
+from .metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_DELAY = 0.02  # Seconds a batch waits for company after its first mutation
+
+_STOP = object()
+
+
+class TagWriter:
+    """The single writer of a catalog's tags.
+
+    Pipelines, the face thread, the GUI and the API queue TagMutations here
+    instead of doing their own read-modify-write. One thread merges them per
+    image and commits up to batch_size submissions per transaction, waiting at
+    most max_delay for a batch to fill. Every submission returns a Future that
+    resolves to the image id once its transaction has committed, or to a
+    {name: id} dict for submissions that span several images.
+    """
+
+    _writers = {}  # database path -> writer shared by the whole process
+    _writers_lock = threading.Lock()
+
+    def __init__(self, localDB, batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY):
+        self.localDB = localDB
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='tag-writer', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def get(cls, localDB):
+        """The process-wide writer for localDB's database."""
+        with cls._writers_lock:
+            writer = cls._writers.get(localDB.DATABASE)
+            if writer is None:
+                writer = cls._writers[localDB.DATABASE] = cls(localDB)
+            return writer
+
+    def submit(self, mutations, many=False):
+        """Queue mutations to be committed together.
+
+        They are mutations of one image, or of several if many is set, and the
+        Future then resolves to {name: id} instead of one id.
+        """
+        future = Future()
+        mutations = tuple(mutations)
+        QUEUE_DEPTH.labels('tag_writer').inc()
+        self._queue.put((mutations, future, many))
+        return future
+
+    def add(self, image_name, source, tags, file_location=None):
+        return self.submit([TagMutation(image_name, 'add', source, tags, file_location)])
+
+    def remove(self, image_name, tags, source=None, file_location=None):
+        """Remove tags from one source, or from every source if source is None."""
+        return self.submit([TagMutation(image_name, 'remove', source, tags, file_location)])
+
+    def replace(self, image_name, source, tags, file_location=None):
+        return self.submit([TagMutation(image_name, 'replace', source, tags, file_location)])
+
+    def replace_sources(self, image_name, sources, file_location=None, versions=None):
+        """Replace several sources at once, e.g. every analyzer of a pipeline run.
+
+        versions maps sources to the analyzer version that produced their tags.
+        """
+        versions = versions or {}
+        # The empty add makes sure the image row exists even if no source has tags
+        mutations = [TagMutation(image_name, 'add', USER_SOURCE, [], file_location)]
+        mutations.extend(TagMutation(image_name, 'replace', source, tags, file_location, versions.get(source))
+                         for source, tags in sources.items())
+        return self.submit(mutations)
+
+    def set_tags(self, image_name, tags, file_location=None, source=USER_SOURCE):
+        """Make the image's tags exactly tags, e.g. after a user edited the whole list.
+
+        Tags that are new are added to source; removed tags are removed from every source.
+        """
+        return self.submit([TagMutation(image_name, 'set', source, tags, file_location)])
+
+    def set_tags_many(self, updates, source=USER_SOURCE):
+        """set_tags for many images, committed in one transaction.
+
+        updates is an iterable of (image_name, tags, file_location). The Future
+        resolves to {image name: image id}.
+        """
+        return self.submit([TagMutation(image_name, 'set', source, tags, file_location)
+                            for image_name, tags, file_location in updates], many=True)
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been committed."""
+        self.submit(()).result(timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            QUEUE_DEPTH.labels('tag_writer').dec(len(batch))
+            if stop:
+                return
+
+    def _commit(self, batch):
+        mutations = [mutation for mutations, _, _ in batch for mutation in mutations]
+        try:
+            ids = self.localDB.apply_tag_mutations(mutations)
+        except Exception as e:
+            if len(batch) > 1:
+                # Commit one submission at a time so a bad one fails alone
+                for item in batch:
+                    self._commit([item])
+                return
+            names = list(dict.fromkeys(mutation.name for mutation in mutations))
+            shown = ', '.join(names[:5]) + (f" and {len(names) - 5} more" if len(names) > 5 else "")
+            logger.error(f"Failed to commit tag mutations for {shown}: {str(e)}")
+            batch[0][1].set_exception(e)
+        else:
+            for mutations, future, many in batch:
+                if many:
+                    future.set_result({mutation.name: ids.get(mutation.name) for mutation in mutations})
+                else:
+                    future.set_result(ids.get(mutations[0].name) if mutations else None)
+
+
+@atexit.register
+def _close_writers():
+    # Commit whatever is still queued before the interpreter goes away
+    with TagWriter._writers_lock:
+        writers = list(TagWriter._writers.values())
+    for writer in writers:
+        writer.close()
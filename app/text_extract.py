@@ -1,6 +1,18 @@
+import re
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import cv2
+import numpy as np
 from PIL import Image
 import pytesseract
-from . import localDB
+from .image_cache import file_fingerprint
+from .metrics import QUEUE_DEPTH, cache_result
+
+# Text-presence prefilter, run on a small grayscale copy before any OCR
+PREFILTER_SIZE = 512
+MIN_EDGE_DENSITY = 0.02  # Fraction of Canny edge pixels; flat images have no text
+MIN_CHARACTER_REGIONS = 12  # Character-sized MSER blobs needed to bother tesseract
+MAX_TEXT_TAGS = 20
 
 def extract_text_from_image(image_path):
     """Extract text from an image and return it as a string."""
@@ -14,18 +26,105 @@ def extract_text_from_image(image_path):
         print(f"Error extracting text from {image_path}: {e}")
         return ""
 
-def add_text_as_tag(image_name, image_path):
-    """Extract text from the image and add it to the tags in the database."""
-    extracted_text = extract_text_from_image(image_path)
-    if extracted_text:
-        # Get existing tags from the database
-        existing_tags = localDB.get_tags(image_name)
-        if existing_tags:
-            new_tags = f"{existing_tags}, {extracted_text}"
-        else:
-            new_tags = extracted_text
-        # Save updated tags back to the database
-        localDB.save_tags(image_name, new_tags)
-        print(f"Updated tags for {image_name}: {new_tags}")
-    else:
-        print(f"No text extracted from {image_path}.")
+def extract_text_from_pixels(image):
+    """Run OCR on an already decoded PIL image or pixel array."""
+    try:
+        return pytesseract.image_to_string(image).strip()
+    except Exception as e:
+        print(f"Error extracting text: {e}")
+        return ""
+
+def text_likelihood(gray):
+    """Count character-like MSER regions in a small grayscale image (0 if it is mostly flat)."""
+    edges = cv2.Canny(gray, 100, 200)
+    if np.count_nonzero(edges) / edges.size < MIN_EDGE_DENSITY:
+        return 0
+
+    height, width = gray.shape
+    mser = cv2.MSER_create()
+    mser.setMinArea(8)
+    mser.setMaxArea(max(64, (height * width) // 200))
+    _, boxes = mser.detectRegions(gray)
+
+    count = 0
+    for x, y, w, h in boxes:
+        # Glyphs are small, roughly upright boxes
+        if 0.01 * height <= h <= 0.2 * height and 0.1 <= w / h <= 2.0:
+            count += 1
+    return count
+
+def might_contain_text(gray):
+    return text_likelihood(gray) >= MIN_CHARACTER_REGIONS
+
+def text_to_tags(text):
+    """Turn OCR output into a short list of lowercase word tags."""
+    tags = []
+    for word in re.findall(r"[A-Za-z0-9][A-Za-z0-9'-]+", text):
+        word = word.lower()
+        if len(word) >= 3 and word not in tags:
+            tags.append(word)
+            if len(tags) >= MAX_TEXT_TAGS:
+                break
+    return tags
+
+def _run_tesseract(gray):
+    # Runs in a worker process. Errors propagate, so a missing or broken
+    # tesseract fails the OCR stage instead of caching empty text for the file
+    return pytesseract.image_to_string(gray).strip()
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+class OCRStage:
+    """Prefiltered, cached OCR that runs tesseract in a pool of worker processes."""
+
+    def __init__(self, localDB, workers=2, prefilter=True):
+        self.localDB = localDB
+        self.workers = workers
+        self.prefilter = prefilter
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn rather than fork: the parent holds torch and OpenCV thread pools
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def extract(self, decoded):
+        """Return a Future with the text of a DecodedImage."""
+        fingerprint = file_fingerprint(decoded.path)
+        cached = self.localDB.get_ocr_text(fingerprint)
+        cache_result('ocr', cached is not None)
+        if cached is not None:
+            return _completed(cached)
+
+        if self.prefilter and not might_contain_text(decoded.gray(PREFILTER_SIZE)):
+            return _completed("")
+
+        QUEUE_DEPTH.labels('ocr').inc()
+        future = self._get_executor().submit(_run_tesseract, decoded.gray())
+
+        def store(done):
+            QUEUE_DEPTH.labels('ocr').dec()
+            # Only real results are cached; a failed run is retried the next time the file is seen
+            if not done.cancelled() and done.exception() is None:
+                self.localDB.save_ocr_text(fingerprint, done.result())
+
+        future.add_done_callback(store)
+        return future
+
+    def resize(self, workers):
+        """Use workers processes from the next extract() on; running OCR jobs finish first."""
+        if workers != self.workers:
+            self.workers = workers
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
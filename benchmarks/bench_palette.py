@@ -0,0 +1,83 @@
+"""Compare ColorThief's MMCQ with app.palette on the colors analyzer's input.
+
+Every image is decoded once and reduced to the 200px variant the colors
+analyzer receives, then both extractors run on the same pixels. Reported:
+median time per image, how many of ColorThief's color names the NumPy
+palette also produces, and the mean RGB distance from each ColorThief color
+to the nearest NumPy color. Run from the repository root:
+
+    python -m benchmarks.bench_palette                  # synthetic corpus
+    python -m benchmarks.bench_palette --images ~/Photos/*.jpg
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from colorthief import ColorThief
+
+from benchmarks import corpus
+from app.localDB import LocalDB
+from app.palette import extract_palette
+from app.pipeline import ColorAnalyzer, DecodedImage
+
+
+def colorthief_palette(image, color_count):
+    color_thief = ColorThief.__new__(ColorThief)  # Skip its own Image.open of the file
+    color_thief.image = image
+    return color_thief.get_palette(color_count=color_count)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def nearest_distance(color, palette):
+    return min(np.linalg.norm(np.subtract(color, other)) for other in palette) if palette else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', nargs='*', help="Image files to use instead of a synthetic corpus")
+    parser.add_argument('--count', type=int, default=60, help="Synthetic images to generate")
+    parser.add_argument('--colors', type=int, default=3, help="Palette size, as the colors analyzer asks for")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.images
+        if not paths:
+            manifest = corpus.generate(os.path.join(tmp, 'corpus'), args.count, args.seed)
+            paths = [os.path.join(tmp, 'corpus', entry['name']) for entry in manifest]
+        localDB = LocalDB(database=os.path.join(tmp, 'palette.db'))
+
+        reference_times, fast_times, agreement, distances = [], [], [], []
+        for path in paths:
+            sample = DecodedImage.open(path, ColorAnalyzer.SAMPLE_SIZE).variant(ColorAnalyzer.SAMPLE_SIZE)
+            pixels = np.asarray(sample)
+            reference, seconds = timed(colorthief_palette, sample, args.colors)
+            reference_times.append(seconds)
+            fast, seconds = timed(extract_palette, pixels, args.colors)
+            fast_times.append(seconds)
+
+            reference_names = {localDB.rgb_to_color_name(rgb) for rgb in reference}
+            fast_names = {localDB.rgb_to_color_name(rgb) for rgb in fast}
+            agreement.append(len(reference_names & fast_names) / len(reference_names) if reference_names else 1.0)
+            distances.extend(nearest_distance(rgb, fast) for rgb in reference)
+
+    reference_ms = statistics.median(reference_times) * 1000
+    fast_ms = statistics.median(fast_times) * 1000
+    print(f"{len(paths)} images, {args.colors} colors each, {ColorAnalyzer.SAMPLE_SIZE}px input")
+    print(f"ColorThief (MMCQ):  {reference_ms:8.2f} ms/image (median)")
+    print(f"NumPy histogram:    {fast_ms:8.2f} ms/image (median)")
+    print(f"speedup:            {reference_ms / fast_ms:8.1f}x")
+    print(f"color names shared: {100 * statistics.mean(agreement):8.1f}% of ColorThief's")
+    print(f"mean RGB distance:  {statistics.mean(distances):8.1f} to the nearest NumPy color")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Compare the torchvision preprocessing chain with app.preprocess on a 24MP JPEG.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_preprocess
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+
+from app.preprocess import load_classifier_input, MEAN, STD
+
+reference_preprocess = transforms.Compose([
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=list(MEAN), std=list(STD)),
+])
+
+
+def reference_load(image_path):
+    image = Image.open(image_path)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return reference_preprocess(image).unsqueeze(0)
+
+
+def make_jpeg(path, width=6000, height=4000, seed=0):
+    # Smooth gradients plus noise so the encoder has realistic work to do
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[..., 0] = x
+    pixels[..., 1] = y
+    pixels[..., 2] = (x + y) / 2
+    pixels ^= rng.integers(0, 32, size=pixels.shape, dtype=np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+
+
+def time_it(func, image_path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(image_path)
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--image', help="Use an existing JPEG instead of a synthetic one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = args.image
+        if not image_path:
+            image_path = os.path.join(tmp, 'synthetic_24mp.jpg')
+            make_jpeg(image_path)
+
+        reference, reference_times = time_it(reference_load, image_path, args.repeat)
+        fast, fast_times = time_it(load_classifier_input, image_path, args.repeat)
+
+    reference_ms = statistics.median(reference_times) * 1000
+    fast_ms = statistics.median(fast_times) * 1000
+    print(f"torchvision chain: {reference_ms:8.1f} ms/image (median of {args.repeat})")
+    print(f"fast path:         {fast_ms:8.1f} ms/image (median of {args.repeat})")
+    print(f"speedup:           {reference_ms / fast_ms:8.1f}x")
+    print(f"shape {tuple(fast.shape)}, mean abs diff vs reference: "
+          f"{(fast - reference).abs().mean().item():.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""/search latency under concurrent clients, blocking vs thread-pooled LocalDB calls.
+
+Serves a populated temporary catalog through two minimal FastAPI apps, one
+calling LocalDB.search_images on the event loop (the old endpoint) and one
+going through app.db_executor.DBExecutor (the current endpoint), and drives
+each with 1..N concurrent clients over httpx's in-process ASGI transport.
+The model is never loaded. Run from the repository root:
+
+    python -m benchmarks.bench_search_concurrency --rows 100000 --clients 1,4,16,64
+
+With the pool, p99 should stay roughly flat as clients grow until the pool
+is saturated; the blocking app's p99 climbs with the number of clients.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from app.localDB import LocalDB
+from app.db_executor import DBExecutor, DEFAULT_DB_THREADS
+from benchmarks.run_benchmarks import populate, summarize
+
+
+class SearchRequest(BaseModel):
+    tags: list
+
+
+def make_apps(localDB, db):
+    blocking = FastAPI()
+    pooled = FastAPI()
+
+    @blocking.post("/search")
+    async def blocking_search(search_request: SearchRequest):
+        return localDB.search_images(search_request.tags)
+
+    @pooled.post("/search")
+    async def pooled_search(search_request: SearchRequest):
+        return await db.run(localDB.search_images, search_request.tags)
+
+    return {'blocking': blocking, 'pooled': pooled}
+
+
+async def drive(app, clients, requests_per_client, queries):
+    transport = httpx.ASGITransport(app=app)
+    timings = []
+
+    async def client(offset):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as http:
+            for i in range(requests_per_client):
+                tags = queries[(offset * requests_per_client + i) % len(queries)]
+                start = time.perf_counter()
+                response = await http.post('/search', json={'tags': tags})
+                response.raise_for_status()
+                timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(offset) for offset in range(clients)))
+    summary = summarize(timings)
+    summary['wall_throughput_per_s'] = len(timings) / (time.perf_counter() - start)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--clients', default='1,4,16,64', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per client")
+    parser.add_argument('--threads', type=int, default=DEFAULT_DB_THREADS, help="DBExecutor pool size")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    from app.classifier import get_categories
+    vocabulary = get_categories()
+    rng = random.Random(args.seed)
+    # Two-tag queries, so almost every request misses the search cache
+    queries = [rng.sample(vocabulary, 2) for _ in range(20000)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'catalog.db')
+        populate(db_path, args.rows, vocabulary, args.seed)
+        localDB = LocalDB(database=db_path)
+        db = DBExecutor(args.threads)
+        apps = make_apps(localDB, db)
+
+        print(f"{'app':>8} {'clients':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+        for clients in (int(level) for level in args.clients.split(',') if level.strip()):
+            for name, app in apps.items():
+                localDB.bump_write_generation()  # Start every run with a cold search cache
+                summary = asyncio.run(drive(app, clients, args.requests, queries))
+                print(f"{name:>8} {clients:>7} {summary['p50_ms']:9.2f} {summary['p99_ms']:9.2f} "
+                      f"{summary['wall_throughput_per_s']:8.1f}")
+        db.shutdown()
+
+
+if __name__ == '__main__':
+    main()
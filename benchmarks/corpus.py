@@ -0,0 +1,107 @@
+"""Deterministic synthetic image corpus for the benchmarks.
+
+The same seed always produces the same files, so timings from different runs
+and machines are comparable. A manifest.json next to the images records
+what each file contains.
+
+    python -m benchmarks.corpus out_dir --count 60
+"""
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+SIZES = [(640, 480), (1280, 960), (1920, 1080), (4000, 3000), (6000, 4000)]
+FORMATS = [('jpg', 'JPEG'), ('png', 'PNG'), ('bmp', 'BMP')]
+WORDS = ['invoice', 'total', 'station', 'exit', 'coffee', 'museum', 'ticket',
+         'parking', 'open', 'menu', 'street', 'welcome', 'platform', 'sale']
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def _background(rng, width, height):
+    # Two-colour gradient plus noise, cheap to build at 24MP
+    start = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    end = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, width, dtype=np.float32)[:, None]
+    row = (start + (end - start) * ramp).astype(np.uint8)
+    pixels = np.broadcast_to(row, (height, width, 3)).copy()
+    noise = np.random.default_rng(rng.randrange(2 ** 32)).integers(0, 24, size=(height, width, 1), dtype=np.uint8)
+    pixels += noise
+    return Image.fromarray(pixels)
+
+
+def _draw_face(draw, rng, width, height):
+    side = min(width, height) // 3
+    x = rng.randrange(0, width - side)
+    y = rng.randrange(0, height - side)
+    skin = (224, 172, 105)
+    draw.ellipse([x, y, x + side, y + int(side * 1.2)], fill=skin)
+    eye = side // 8
+    for ex in (x + side // 3, x + 2 * side // 3):
+        draw.ellipse([ex - eye, y + side // 3, ex + eye, y + side // 3 + eye], fill=(40, 30, 20))
+    draw.rectangle([x + side // 2 - eye // 2, y + side // 2, x + side // 2 + eye // 2, y + side * 2 // 3],
+                   fill=(200, 140, 90))
+    draw.arc([x + side // 4, y + side * 2 // 3, x + 3 * side // 4, y + side], 20, 160, fill=(120, 30, 30),
+             width=max(2, side // 40))
+
+
+def _draw_text(draw, rng, width, height):
+    font = _font(max(12, height // 20))
+    lines = [' '.join(rng.choice(WORDS) for _ in range(3)) for _ in range(rng.randint(2, 5))]
+    y = height // 10
+    for line in lines:
+        draw.text((width // 10, y), line, fill=(0, 0, 0), font=font)
+        y += max(14, height // 12)
+    return lines
+
+
+def generate(out_dir, count=60, seed=1234):
+    """Write count images to out_dir and return the manifest entries."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    manifest = []
+    for index in range(count):
+        width, height = SIZES[index % len(SIZES)]
+        extension, image_format = FORMATS[(index // len(SIZES)) % len(FORMATS)]
+        has_face = rng.random() < 0.4
+        has_text = rng.random() < 0.4
+
+        image = _background(rng, width, height)
+        draw = ImageDraw.Draw(image)
+        if has_face:
+            _draw_face(draw, rng, width, height)
+        text = _draw_text(draw, rng, width, height) if has_text else []
+
+        name = f"synthetic_{index:04d}.{extension}"
+        save_args = {'quality': 90} if image_format == 'JPEG' else {}
+        image.save(os.path.join(out_dir, name), image_format, **save_args)
+        manifest.append({'name': name, 'width': width, 'height': height, 'format': image_format,
+                         'has_face': has_face, 'has_text': has_text, 'text': text})
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--count', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+    manifest = generate(args.out_dir, args.count, args.seed)
+    print(f"Wrote {len(manifest)} images to {args.out_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Load test for the API while a processing run is active.
+
+Concurrent clients send a weighted mix of /search, /get_tags, /update_tags
+and /processing_status requests for a fixed duration, and the tool reports
+throughput and p50/p95/p99 latency per endpoint. By default the app in
+app/main.py is served in-process through httpx's ASGI transport, inside a
+scratch directory holding a populated catalog, with model inference replaced
+by a fixed sleep so it runs on any machine. Run from the repository root:
+
+    python -m benchmarks.loadtest --clients 32 --duration 30 --process 500
+    python -m benchmarks.loadtest --inference-ms 0 --mix search=1          # search only
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --folder /photos
+
+With --url the requests go to a running uvicorn instance instead; --folder
+then names a directory on that server to process during the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.run_benchmarks import populate, summarize
+
+DEFAULT_MIX = 'search=6,get_tags=1,update_tags=2,processing_status=1'
+
+
+def parse_mix(value):
+    """'search=6,get_tags=1' -> {'search': 6.0, 'get_tags': 1.0}"""
+    mix = {}
+    for part in value.split(','):
+        if '=' in part:
+            name, weight = part.split('=', 1)
+            mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(REQUESTS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown endpoints: {sorted(unknown)}")
+    return mix
+
+
+def search_request(rng, names, vocabulary):
+    return 'POST', '/search', {'tags': [rng.choice(vocabulary)]}
+
+
+def get_tags_request(rng, names, vocabulary):
+    return 'GET', '/get_tags', None
+
+
+def update_tags_request(rng, names, vocabulary):
+    return 'POST', '/update_tags', {'filename': rng.choice(names), 'tags': rng.sample(vocabulary, 4)}
+
+
+def processing_status_request(rng, names, vocabulary):
+    return 'GET', '/processing_status', None
+
+
+REQUESTS = {
+    'search': search_request,
+    'get_tags': get_tags_request,
+    'update_tags': update_tags_request,
+    'processing_status': processing_status_request,
+}
+
+
+def stub_pipeline(inference_seconds, vocabulary, seed):
+    """Pipeline that skips decoding and sleeps instead of running the models."""
+    from app.pipeline import Pipeline, PipelineResult
+
+    class StubPipeline(Pipeline):
+        def __init__(self):
+            super().__init__([])
+            self.rng = random.Random(seed)
+
+        def process(self, path, only=None):
+            result = PipelineResult(path)
+            start = time.perf_counter()
+            time.sleep(inference_seconds)  # Inference releases the GIL, so sleeping is a fair stand-in
+            result.tags['classifier'] = self.rng.sample(vocabulary, 5)
+            result.versions['classifier'] = 'stub'
+            self._record(result, 'classifier', start)
+            return result
+
+    return StubPipeline()
+
+
+def in_process_app(args, work_dir, vocabulary):
+    """Import app.main inside work_dir, where its relative data/ and logs/ paths land,
+    and swap its pipeline for the stub. Returns (app, image names, folder to process)."""
+    os.makedirs(os.path.join(work_dir, 'data'))
+    os.makedirs(os.path.join(work_dir, 'logs'))
+    os.chdir(work_dir)
+    from app.localDB import LocalDB
+    populate(LocalDB.DATABASE, args.rows, vocabulary, args.seed)
+
+    from app import classifier
+    if args.inference_ms is not None:
+        classifier.get_model = lambda: None  # Never load the weights
+    from app import main
+    if args.inference_ms is not None:
+        main.pipeline = stub_pipeline(args.inference_ms / 1000, vocabulary, args.seed)
+
+    folder = None
+    if args.process:
+        # Empty files are enough: the stub pipeline never opens them
+        folder = os.path.join(work_dir, 'incoming')
+        os.makedirs(folder)
+        for i in range(args.process):
+            open(os.path.join(folder, f"new_{i:06d}.jpg"), 'wb').close()
+    names = [f"img_{i:07d}.jpg" for i in range(args.rows)]
+    return main.app, names, folder
+
+
+async def start_processing(http, folder):
+    response = await http.post('/set_folder', json={'folder': folder})
+    response.raise_for_status()
+    # In-process, the response only arrives once the background task is done, so never await it here
+    return asyncio.ensure_future(http.get('/process_images', timeout=None))
+
+
+async def run_load(http, args, mix, names, vocabulary):
+    endpoints = list(mix)
+    weights = [mix[name] for name in endpoints]
+    timings = {name: [] for name in endpoints}
+    errors = {name: 0 for name in endpoints}
+    deadline = time.perf_counter() + args.duration
+
+    async def client(index):
+        rng = random.Random(args.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            method, path, body = REQUESTS[endpoint](rng, names, vocabulary)
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, path, json=body)
+                response.raise_for_status()
+                payload = response.json()
+                if isinstance(payload, dict) and 'error' in payload:
+                    raise ValueError(payload['error'])  # The API reports bad requests with status 200
+            except Exception:
+                errors[endpoint] += 1
+                continue
+            timings[endpoint].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(index) for index in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    report = {}
+    for endpoint in endpoints:
+        summary = summarize(timings[endpoint])
+        summary['errors'] = errors[endpoint]
+        summary['wall_throughput_per_s'] = len(timings[endpoint]) / elapsed
+        report[endpoint] = summary
+    return report
+
+
+async def run(args, mix):
+    if args.url:
+        transport, base_url, folder = None, args.url, args.folder
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+            response = await http.get('/get_tags')
+            response.raise_for_status()
+            catalog = response.json()
+            names = list(catalog)
+            vocabulary = sorted({tag for tags in catalog.values() for tag in tags if tag})
+        if not names or not vocabulary:
+            sys.exit(f"{args.url} has an empty catalog; tag some images first")
+    else:
+        from app.classifier import get_categories
+        vocabulary = get_categories()
+        work_dir = tempfile.mkdtemp(prefix='loadtest-')
+        app, names, folder = in_process_app(args, work_dir, vocabulary)
+        transport, base_url = httpx.ASGITransport(app=app), 'http://loadtest'
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as http:
+        processing = await start_processing(http, folder) if folder else None
+        report = await run_load(http, args, mix, names, vocabulary)
+        if processing is not None:
+            status = (await http.get('/processing_status')).json()
+            report['processing'] = {'processed': status['processed'], 'total': status['total']}
+            processing.cancel()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Base URL of a running server (default: serve app.main in-process)")
+    parser.add_argument('--folder', help="With --url: directory on the server to process during the run")
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds to keep sending requests")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--rows', type=int, default=10000, help="In-process: catalog size")
+    parser.add_argument('--process', type=int, default=200,
+                        help="In-process: images to process during the run (0 for an idle server)")
+    parser.add_argument('--inference-ms', type=float, default=50.0,
+                        help="In-process: stubbed per-image inference time; pass a negative value "
+                             "to load the real model")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help="Also write the report as JSON")
+    args = parser.parse_args()
+    if args.inference_ms is not None and args.inference_ms < 0:
+        args.inference_ms = None
+    if args.output:
+        args.output = os.path.abspath(args.output)  # The in-process server runs in a scratch directory
+
+    report = asyncio.run(run(args, args.mix))
+
+    print(f"{'endpoint':>18} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, summary in report.items():
+        if endpoint == 'processing':
+            continue
+        print(f"{endpoint:>18} {summary['count']:>8} {summary['errors']:>6} {summary['wall_throughput_per_s']:8.1f} "
+              f"{summary['p50_ms']:9.2f} {summary['p95_ms']:9.2f} {summary['p99_ms']:9.2f}")
+    if 'processing' in report:
+        print(f"Processed {report['processing']['processed']} of {report['processing']['total']} images during the run")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Offline benchmark suite for the tagging pipeline and the catalog database.
+
+Generates a deterministic synthetic corpus (benchmarks/corpus.py) and measures:
+
+- each per-image entry point (classifier, colors, faces, OCR) on its own,
+- each stage of the decode-once pipeline,
+- LocalDB.save_tags and LocalDB.search_images latency at several catalog sizes.
+
+Results are written as JSON. With --baseline, every latency and throughput
+figure is compared with a stored run, and regressions beyond --tolerance are
+listed (and fail the run with --fail-on-regression).
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmarks import corpus
+from app.localDB import LocalDB
+from app.pipeline import default_pipeline
+
+DEFAULT_DB_SIZES = '10000,100000,1000000'
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(timings):
+    total = sum(timings)
+    return {
+        'count': len(timings),
+        'throughput_per_s': len(timings) / total if total else 0.0,
+        'mean_ms': 1000 * total / len(timings) if timings else 0.0,
+        'p50_ms': 1000 * percentile(timings, 50),
+        'p95_ms': 1000 * percentile(timings, 95),
+        'p99_ms': 1000 * percentile(timings, 99),
+    }
+
+
+def _timed_calls(func, args_list):
+    timings, errors = [], []
+    for args in args_list:
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        timings.append(time.perf_counter() - start)
+    summary = summarize(timings)
+    if errors:
+        summary['errors'] = len(errors)
+        summary['first_error'] = errors[0]
+    return summary
+
+
+def bench_entry_points(paths, localDB, stages):
+    """Time the standalone per-image functions, each of which decodes the file itself."""
+    results = {}
+    if 'classifier' in stages:
+        from app.classifier import classify
+        from app.preprocess import load_classifier_input
+        results['generate_tags'] = _timed_calls(lambda p: classify(load_classifier_input(p)), [(p,) for p in paths])
+    if 'colors' in stages:
+        results['get_main_colors'] = _timed_calls(localDB.get_main_colors, [(p,) for p in paths])
+    if 'faces' in stages:
+        from app.face_detect import detect_faces
+        results['detect_faces'] = _timed_calls(detect_faces, [(p,) for p in paths])
+    if 'ocr' in stages:
+        from app.text_extract import extract_text_from_image
+        results['extract_text_from_image'] = _timed_calls(extract_text_from_image, [(p,) for p in paths])
+    return results
+
+
+def bench_pipeline(paths, localDB, stages):
+    pipeline = default_pipeline(localDB)
+    for name in pipeline.analyzers:
+        pipeline.set_enabled(name, name in stages)
+
+    per_stage = {}
+    totals = []
+    for path in paths:
+        start = time.perf_counter()
+        result = pipeline.process(path)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in result.timings.items():
+            per_stage.setdefault(stage, []).append(seconds)
+
+    results = {stage: summarize(timings) for stage, timings in per_stage.items()}
+    results['total'] = summarize(totals)
+    ocr = pipeline.analyzers.get('ocr')
+    if ocr is not None and ocr.stage is not None:
+        ocr.stage.shutdown()
+    return results
+
+
+def populate(db_path, rows, vocabulary, seed):
+    """Bulk-load rows directly; going through save_tags would take hours at 1M."""
+    LocalDB(database=db_path)  # Creates the schema
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO images (name, tags, file_location, processed) VALUES (?, ?, ?, 1)",
+            ((f"img_{i:07d}.jpg", ', '.join(rng.sample(vocabulary, 8)), f"/corpus/img_{i:07d}.jpg")
+             for i in range(rows)))
+    conn.close()
+
+
+def bench_db(sizes, vocabulary, writes, queries, seed, tmp_dir):
+    results = {}
+    for rows in sizes:
+        db_path = os.path.join(tmp_dir, f"catalog_{rows}.db")
+        start = time.perf_counter()
+        populate(db_path, rows, vocabulary, seed)
+        load_seconds = time.perf_counter() - start
+
+        localDB = LocalDB(database=db_path)
+        rng = random.Random(seed + rows)
+        write_args = [(f"img_{rng.randrange(rows):07d}.jpg", rng.sample(vocabulary, 8), "/corpus/x.jpg")
+                      for _ in range(writes)]
+        search_args = [([rng.choice(vocabulary)],) for _ in range(queries)]
+        results[str(rows)] = {
+            'bulk_load_seconds': load_seconds,
+            'save_tags': _timed_calls(lambda name, tags, location: localDB.save_tags(name, tags, location,
+                                                                                   with_colors=False),
+                                      write_args),
+            'search_images': _timed_calls(localDB.search_images, search_args),
+        }
+        os.remove(db_path)
+    return results
+
+
+def _metrics(results, prefix=''):
+    """Flatten nested results into {'a/b/p50_ms': value} for comparable figures only."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_metrics(value, path + '/'))
+        elif key.endswith('_ms') or key == 'throughput_per_s':
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    """Return [(metric, baseline, current, change)] for figures that got worse than tolerance."""
+    regressions = []
+    base = _metrics(baseline.get('results', {}))
+    for metric, value in _metrics(current['results']).items():
+        if metric not in base or not base[metric]:
+            continue
+        change = (value - base[metric]) / base[metric]
+        if metric.endswith('throughput_per_s'):
+            change = -change  # Lower throughput is the regression
+        if change > tolerance:
+            regressions.append((metric, base[metric], value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=30, help="Synthetic images to generate")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--stages', default='phash,classifier,colors,faces,ocr',
+                        help="Comma-separated analyzers to benchmark")
+    parser.add_argument('--db-sizes', default=DEFAULT_DB_SIZES, help="Comma-separated catalog sizes")
+    parser.add_argument('--writes', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--output', help="Write results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="Compare against this results JSON")
+    parser.add_argument('--save-baseline', help="Also write the results to this path")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    stages = {stage.strip() for stage in args.stages.split(',') if stage.strip()}
+    sizes = [int(size) for size in args.db_sizes.split(',') if size.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_dir = os.path.join(tmp_dir, 'corpus')
+        manifest = corpus.generate(image_dir, args.images, args.seed)
+        paths = [os.path.join(image_dir, entry['name']) for entry in manifest]
+        localDB = LocalDB(database=os.path.join(tmp_dir, 'pipeline.db'))
+
+        from app.classifier import get_categories
+        vocabulary = get_categories()  # ImageNet labels are what the catalog mostly holds
+
+        results = {
+            'entry_points': bench_entry_points(paths, localDB, stages),
+            'pipeline': bench_pipeline(paths, localDB, stages),
+            'database': bench_db(sizes, vocabulary, args.writes, args.queries, args.seed, tmp_dir),
+        }
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'images': args.images,
+            'seed': args.seed,
+            'stages': sorted(stages),
+            'db_sizes': sizes,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = [
+            {'metric': metric, 'baseline': base, 'current': value, 'change': change}
+            for metric, base, value, change in regressions
+        ]
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text)
+
+    for metric, base, value, change in regressions:
+        print(f"REGRESSION {metric}: {base:.3f} -> {value:.3f} ({change:+.0%})", file=sys.stderr)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,11 @@ from PyQt5.QtCore import QTimer
 from app.main import app as fastapi_app
 from app.app import ImageTaggerApp, CloseHandler
 import logging
+from app.logging_setup import configure_logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging: app.main has already picked the log file and app.app added a
+# WARNING console; show INFO on it when running both together
+configure_logging(console=True, console_level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ServerThread(threading.Thread):